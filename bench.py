@@ -0,0 +1,304 @@
+'''吞吐量基准：用合成开奖历史测量各计分引擎在不同号码池上的组合/秒
+
+用法：python bench.py [--draws=2000] [--sample=3000] [--engines=loop,numpy,bnb,index] [--games=39/5,49/6,80/7]
+每个游戏取号码池中段的一段排名区间在本进程内计分，并检查各引擎的小堆与 loop 一致。
+
+历史长度模式：python bench.py --lengths=1000,5000,20000,50000 [--engines=loop,index] [--sample=3000]
+同一段排名区间在不同长度的合成历史上计分，列出装载（含 index 引擎建索引）与计分耗时及相对 loop 的倍数，
+看各引擎随期数增长的走势。
+
+分阶段模式：python bench.py --stages [--top=200] [--history[=bench_history.json]] [--tolerance=0.25]
+对每个游戏与引擎分别计时 载入（find_test.read_draws 读工作簿）、存档（draw_store 映射未变动的
+开奖存档）、掩码、计分、合并、差值
+（compute_max_gap 复算并核对）、回测（find_test 直方图）与写回（xlsm_io.replace_sheet），
+只需 CPU，不需要 Excel。给出 --history 时把本次结果追加到 JSON 历史，并与同参数最近几次的
+中位数比较，变慢超过 tolerance 的阶段标记为回归（退出码 1）。
+
+启动模式：python bench.py --startup[=report.txt] [--runs=7] [--history[=...]]
+以 -X importtime 测量入口模块的导入耗时（取中位数），与 STARTUP_BUDGET_MS 比较，并检查
+STARTUP_FORBIDDEN 中的重型套件没有在启动时载入。spawn 出的子进程会重新执行主脚本的顶层，
+所以 mac_app／find_test 的导入链就是每个计算子进程的启动成本。超出预算时退出码 1。
+'''
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import statistics
+from math import comb
+
+import lottery_search
+import xlsm_io
+from xlsm_io import split_options
+
+STAGES = ['载入', '存档', '掩码', '计分', '合并', '差值', '回测', '写回']
+GAP_RULES = [(2, False), (3, False), (4, True), (5, True)]   # 四段各自的 (门槛, 是否恰好命中)
+history_keep = 5        # 回归比较取同参数最近几次运行的中位数
+noise_floor = 0.005     # 差距小于此秒数的阶段不判为回归
+
+GAMES = [(39, 5), (49, 6), (80, 7)]     # (号码池大小, 每期开出个数)
+
+# 启动预算（毫秒，-X importtime 的累计值）：入口脚本与子进程要装载的计分核心
+STARTUP_BUDGET_MS = {'mac_app': 60, 'find_test': 60, 'lottery_search': 40}
+STARTUP_FORBIDDEN = ('pandas', 'openpyxl', 'tkinter', 'numpy')   # 用到时才在函数内导入
+
+def synthetic_draws(pool, pick, n_draws, seed=0):
+    rnd = random.Random(seed)
+    return [sorted(rnd.sample(range(1, pool + 1), pick)) for _ in range(n_draws)]
+
+def bench_engine(engine, masks, pool, combo_size, rank_range):
+    '''在本进程内按子进程的方式装载掩码，返回 (耗时秒数, 四个小堆)'''
+    flat = lottery_search.pack_words(masks, lottery_search.mask_words(pool))
+    lottery_search.init_worker(flat, len(masks), combo_size, lottery_search.top_n, engine, None, pool)
+    t0 = time.perf_counter()
+    _, heaps, _ = lottery_search.run_chunk(rank_range)
+    return time.perf_counter() - t0, heaps
+
+def bench_pools(games, n_draws, sample, engines):
+    print(f'{"号码池":>6} {"每期":>4} {"组合":>4} {"引擎":>6} {"组合/秒":>12}  与 loop 一致')
+    rows = []
+    for pool, pick in games:
+        masks, _ = lottery_search.build_masks(synthetic_draws(pool, pick, n_draws), pool)
+        total = comb(pool, pick)
+        start = total // 2
+        rank_range = (start, min(start + sample, total))
+        ref = None
+        for engine in engines:
+            secs, heaps = bench_engine(engine, masks, pool, pick, rank_range)
+            if engine == 'loop':
+                ref = heaps
+            rate = (rank_range[1] - rank_range[0]) / secs
+            same = '-' if ref is None or engine == 'loop' else ('是' if heaps == ref else '否')
+            print(f'{pool:>6} {pick:>4} {pick:>4} {engine:>6} {rate:>12,.0f}  {same}')
+            rows.append({'pool': pool, 'pick': pick, 'engine': engine, 'combos_per_sec': rate, 'same': same})
+    return rows
+
+def bench_lengths(games, lengths, sample, engines):
+    '''各历史长度下各引擎的装载／计分耗时，返回行列表'''
+    print(f'{"号码池":>6} {"每期":>4} {"期数":>6} {"引擎":>6} {"装载s":>8} {"计分s":>8} {"组合/秒":>12} {"对 loop":>8}  一致')
+    rows = []
+    for pool, pick in games:
+        total = comb(pool, pick)
+        start = total // 2
+        rank_range = (start, min(start + sample, total))
+        n = rank_range[1] - rank_range[0]
+        for n_draws in lengths:
+            masks, _ = lottery_search.build_masks(synthetic_draws(pool, pick, n_draws), pool)
+            flat = lottery_search.pack_words(masks, lottery_search.mask_words(pool))
+            ref = base = None
+            for engine in engines:
+                t0 = time.perf_counter()
+                lottery_search.init_worker(flat, n_draws, pick, lottery_search.top_n, engine, None, pool)
+                load = time.perf_counter() - t0
+                t0 = time.perf_counter()
+                _, heaps, _ = lottery_search.run_chunk(rank_range)
+                secs = time.perf_counter() - t0
+                if engine == 'loop':
+                    ref, base = heaps, secs
+                speedup = f'{base / secs:.1f}x' if base else '-'
+                same = '-' if ref is None or engine == 'loop' else ('是' if heaps == ref else '否')
+                print(f'{pool:>6} {pick:>4} {n_draws:>6} {engine:>6} {load:>8.3f} {secs:>8.3f} {n / secs:>12,.0f} {speedup:>8}  {same}')
+                rows.append({'pool': pool, 'pick': pick, 'draws': n_draws, 'engine': engine, 'load': load,
+                             'secs': secs, 'same': same})
+    return rows
+
+def write_history_workbook(path, draws):
+    '''把合成历史写成第一列为表头的 xlsx（不计时），供载入阶段读取'''
+    import openpyxl
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('球號')
+    ws.append([f'號碼{i}' for i in range(1, len(draws[0]) + 1)])
+    for d in draws:
+        ws.append(d)
+    wb.save(path)
+
+def result_rows(merged, combo_size):
+    '''全局小堆 → 与「獲獎排列」相同版式的行（四段，段间空一栏）'''
+    sections = [[list(row[0]) + list(row[1:]) for _, row in sorted(h, key=lambda e: e[0], reverse=True)]
+                for h in merged]
+    widths = [combo_size + 6, combo_size + 5, combo_size + 4, combo_size + 3]
+    rows = []
+    for i in range(max(len(s) for s in sections)):
+        row = []
+        for sec, w in zip(sections, widths):
+            row += (sec[i] if i < len(sec) else [''] * w) + [None]
+        rows.append(row[:-1])
+    return rows
+
+def bench_stages(games, n_draws, sample, engines, top):
+    '''各游戏 × 引擎的分阶段耗时，返回 {'池/每期/引擎/阶段': 秒数}'''
+    import find_test
+    import draw_store
+    ls = lottery_search
+    ls.top_n = top
+    timings = {}
+    tmp = tempfile.mkdtemp(prefix='bench_')
+    print(f'{"号码池":>6} {"每期":>4} {"引擎":>6}  ' + '  '.join(f'{s:>6}' for s in STAGES))
+    for pool, pick in games:
+        book = os.path.join(tmp, f'h{pool}_{pick}.xlsx')
+        write_history_workbook(book, synthetic_draws(pool, pick, n_draws))
+        cols = f'A:{xlsm_io.col_letter(pick)}'
+        store = os.path.join(tmp, f'h{pool}_{pick}.draws')
+
+        def read_rows(book=book, cols=cols):
+            wb = xlsm_io.open_readonly(book)
+            yield from find_test.iter_draws(wb['球號'], cols)
+            wb.close()
+
+        draw_store.sync_store(store, book, '球號', 'bench', pool, pick, read_rows)   # 建立存档，不计时
+        total = comb(pool, pick)
+        start = total // 2
+        rank_range = (start, min(start + sample, total))
+        for engine in engines:
+            t = {}
+            t0 = time.perf_counter()
+            wb = xlsm_io.open_readonly(book)
+            draws = find_test.read_draws(wb['球號'], cols)
+            wb.close()
+            t['载入'] = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            masks, _ = ls.build_masks(draws, pool)
+            flat = ls.pack_words(masks, ls.mask_words(pool))
+            t['掩码'] = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            stored, _, _ = draw_store.sync_store(store, book, '球號', 'bench', pool, pick, read_rows)
+            t['存档'] = time.perf_counter() - t0
+            if stored != masks:
+                raise AssertionError('开奖存档的掩码与 build_masks 不一致')
+
+            ls.init_worker(flat, len(masks), pick, top, engine, None, pool)
+            t0 = time.perf_counter()
+            _, (heaps,), _ = ls.run_chunk(rank_range)
+            t['计分'] = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            merged = ([], [], [], [])
+            ls.merge_partial(merged, heaps)
+            t['合并'] = time.perf_counter() - t0
+
+            # 参考实现复算最大差值，并核对计分阶段一并算出的差值
+            t0 = time.perf_counter()
+            for heap, (thr, exact) in zip(merged, GAP_RULES):
+                for _, row in heap:
+                    if ls.compute_max_gap(row[0], masks, thr, exact) != row[-1]:
+                        raise AssertionError(f'{engine} 的最大差值与 compute_max_gap 不一致：{row}')
+            t['差值'] = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            find_test.engine = 'index' if engine == 'index' else 'loop'
+            fmasks = find_test.draw_masks(draws)
+            find_test.section_histograms(fmasks, [row[0] for _, row in merged[0]])
+            t['回测'] = time.perf_counter() - t0
+
+            rows = result_rows(merged, pick)
+            t0 = time.perf_counter()
+            xlsm_io.replace_sheet(book, '獲獎排列', rows, index=1)
+            t['写回'] = time.perf_counter() - t0
+
+            print(f'{pool:>6} {pick:>4} {engine:>6}  ' + '  '.join(f'{t[s]:>6.3f}' for s in STAGES))
+            for stage, secs in t.items():
+                timings[f'{pool}/{pick}/{engine}/{stage}'] = secs
+    return timings
+
+def import_profile(module, runs):
+    '''在新的直译器中重复 import module，返回 (累计毫秒的中位数, 最后一次的 {模块: (自身, 累计)})'''
+    import subprocess
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)    # 先让 .pyc 就位，免得把编译时间算进去
+    here = os.path.dirname(os.path.abspath(__file__))
+    totals, mods = [], {}
+    for i in range(runs + 1):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                              cwd=here, env=env, capture_output=True, text=True, check=True)
+        mods = {}
+        for line in proc.stderr.splitlines():
+            parts = line.removeprefix('import time:').split('|')
+            if len(parts) != 3 or not parts[0].strip().isdigit():
+                continue
+            mods[parts[2].strip()] = (int(parts[0]) / 1000, int(parts[1]) / 1000)
+        if i:
+            totals.append(mods[module][1])
+    return statistics.median(totals), mods
+
+def bench_startup(runs, report=None):
+    '''各入口模块的导入耗时与预算、禁用套件检查，返回 ({'startup/模块': 秒数}, 是否全部通过)'''
+    lines, timings, ok = [], {}, True
+    for module, budget in STARTUP_BUDGET_MS.items():
+        total, mods = import_profile(module, runs)
+        heavy = sorted({m.split('.')[0] for m in mods} & set(STARTUP_FORBIDDEN))
+        passed = total <= budget and not heavy
+        ok &= passed
+        timings[f'startup/{module}'] = total / 1000
+        lines.append(f'{module}: {total:.1f} ms（预算 {budget} ms）' + (f'，载入了 {", ".join(heavy)}' if heavy else '')
+                     + ('' if passed else '  ← 超出'))
+        for name, (own, cum) in sorted(mods.items(), key=lambda kv: -kv[1][0])[:8]:
+            lines.append(f'    {own:7.2f} ms 自身 {cum:8.2f} ms 累计  {name}')
+    text = '\n'.join(lines)
+    print(text)
+    if report:
+        with open(report, 'w', encoding='utf-8') as f:
+            f.write(f'# python -X importtime，{runs} 次中位数，Python {sys.version.split()[0]}\n{text}\n')
+        print(f'已写入 {report}')
+    return timings, ok
+
+def check_history(path, params, timings, tolerance):
+    '''与同参数最近 history_keep 次的中位数比较，追加本次记录，返回回归列表 [(键, 本次, 中位数)]'''
+    history = []
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            history = json.load(f)
+    prev = [h['timings'] for h in history if h['params'] == params][-history_keep:]
+    regressions = []
+    for key, secs in timings.items():
+        past = [p[key] for p in prev if key in p]
+        if not past:
+            continue
+        med = statistics.median(past)
+        if secs > med * (1 + tolerance) and secs - med > noise_floor:
+            regressions.append((key, secs, med))
+    history.append({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'params': params, 'timings': timings,
+                    'regressions': [k for k, _, _ in regressions]})
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=1)
+    return regressions
+
+if __name__ == '__main__':
+    argv, opts = split_options(sys.argv)
+    games = GAMES
+    if opts.get('games'):
+        games = [tuple(int(x) for x in g.split('/')) for g in opts['games'].split(',')]
+    engines = opts.get('engines', 'loop,numpy,bnb,index').split(',')
+    n_draws = int(opts.get('draws', 2000))
+    sample = int(opts.get('sample', 3000))
+    if 'startup' in opts:
+        runs = int(opts.get('runs', 7))
+        timings, ok = bench_startup(runs, opts['startup'] or None)
+        if 'history' in opts:
+            path = opts['history'] or 'bench_history.json'
+            regressions = check_history(path, {'startup': runs}, timings, float(opts.get('tolerance', 0.25)))
+            for key, secs, med in regressions:
+                print(f'回归：{key} {secs * 1000:.1f}ms，最近中位数 {med * 1000:.1f}ms')
+            ok &= not regressions
+        sys.exit(0 if ok else 1)
+    if opts.get('lengths'):
+        bench_lengths(games, [int(x) for x in opts['lengths'].split(',')], sample,
+                      opts.get('engines', 'loop,index').split(','))
+        sys.exit(0)
+    if 'stages' not in opts:
+        bench_pools(games, n_draws, sample, engines)
+        sys.exit(0)
+
+    top = int(opts.get('top', 200))
+    timings = bench_stages(games, n_draws, sample, engines, top)
+    if 'history' in opts:
+        path = opts['history'] or 'bench_history.json'
+        params = {'games': [list(g) for g in games], 'engines': engines, 'draws': n_draws,
+                  'sample': sample, 'top': top}
+        regressions = check_history(path, params, timings, float(opts.get('tolerance', 0.25)))
+        for key, secs, med in regressions:
+            print(f'回归：{key} {secs:.3f}s，最近中位数 {med:.3f}s（+{(secs / med - 1) * 100:.0f}%）')
+        print(f'已记录到 {path}，' + (f'{len(regressions)} 项回归' if regressions else '没有回归'))
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,163 @@
+'''增量回测缓存：逐组合保存各门槛的命中数、最后命中期与最大差值，新增期数只需计算增量'''
+import os
+import hashlib
+from math import comb
+
+import numpy as np
+
+from lottery_engine import block_size, match_counts, pack_masks, score_weights, unpack_mask
+from lottery_search import mask_words
+from combo_rank import iter_masks, mask_to_combo
+
+CACHE_VERSION = 3
+COUNT_FIELDS = ('cnt2', 'cnt3', 'cnt4', 'cntE4', 'cnt5', 'cntE5')
+LAST_FIELDS = ('last2', 'last3', 'lastE4', 'last5', 'lastE5')
+GAP_FIELDS = ('gap2', 'gap3', 'gapE4', 'gapE5')
+
+# (门槛, 是否精确, 计数字段, 最后命中字段, 最大差值字段)
+SPECS = (
+    (2, False, 'cnt2', 'last2', 'gap2'),
+    (3, False, 'cnt3', 'last3', 'gap3'),
+    (4, False, 'cnt4', None, None),
+    (4, True, 'cntE4', 'lastE4', 'gapE4'),
+    (5, False, 'cnt5', 'last5', None),
+    (5, True, 'cntE5', 'lastE5', 'gapE5'),
+)
+
+def default_cache_path(file_path, combo_size):
+    return os.path.splitext(file_path)[0] + f'.c{combo_size}.npz'
+
+def history_hash(masks):
+    '''期数掩码序列的内容哈希，用于判断缓存是否为当前历史的前缀'''
+    return hashlib.sha1(','.join(map(str, masks)).encode()).hexdigest()
+
+def all_combo_masks(combo_size, pool_size):
+    '''按 colex 排名顺序生成全部组合的打包掩码（下标即 combo_rank 的排名）'''
+    return pack_masks(list(iter_masks(0, comb(pool_size, combo_size), combo_size)), mask_words(pool_size))
+
+def new_state(n_combos):
+    state = {f: np.zeros(n_combos, dtype=np.int32) for f in COUNT_FIELDS + GAP_FIELDS}
+    state.update({f: np.full(n_combos, -1, dtype=np.int32) for f in LAST_FIELDS})
+    return state
+
+def update_state(state, c_masks, new_masks, start):
+    '''把第 start+1 期起的新掩码逐期并入状态；每期只对命中的组合做花式索引更新'''
+    words = c_masks.shape[1]
+    for idx, lm in enumerate(new_masks, start=start + 1):
+        matches = match_counts(c_masks, pack_masks([lm], words))[:, 0]
+        for thr, exact, cnt_f, last_f, gap_f in SPECS:
+            hits = np.flatnonzero(matches == thr if exact else matches >= thr)
+            if not len(hits):
+                continue
+            state[cnt_f][hits] += 1
+            if gap_f is not None:
+                prev = np.maximum(state[last_f][hits], 0)
+                state[gap_f][hits] = np.maximum(state[gap_f][hits], idx - prev)
+            if last_f is not None:
+                state[last_f][hits] = idx
+
+def load_cache(path, combo_size, pool_size):
+    '''读取缓存，返回 (state, 已计入期数, 历史哈希)；不存在或不兼容时返回 None'''
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as z:
+            if (int(z['version']) != CACHE_VERSION or int(z['combo_size']) != combo_size
+                    or int(z['pool_size']) != pool_size):
+                return None
+            state = {f: z[f] for f in COUNT_FIELDS + LAST_FIELDS + GAP_FIELDS}
+            return state, int(z['n_draws']), str(z['history'])
+    except Exception as e:
+        print('读取缓存失败，将重新计算：', e)
+        return None
+
+def save_cache(path, combo_size, pool_size, state, masks):
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, version=CACHE_VERSION, combo_size=combo_size, pool_size=pool_size, n_draws=len(masks),
+             history=history_hash(masks), **state)
+    os.replace(tmp, path)
+
+def sync_cache(path, combo_size, pool_size, masks, warm=None):
+    '''使缓存与当前历史一致：前缀哈希相符时只计算新增期数，否则全量重建
+
+    warm 为常驻进程保留在内存中的 (state, c_masks, 已计入期数, 历史哈希)，给出时不再读盘、
+    也不重新生成组合掩码（state 会被就地更新）。返回 (state, c_masks, 本次计算的期数)。
+    '''
+    if warm is not None:
+        state, c_masks, n, h = warm
+        cached = state, n, h
+    else:
+        c_masks = all_combo_masks(combo_size, pool_size)
+        cached = load_cache(path, combo_size, pool_size)
+    start = 0
+    if cached is not None:
+        state, n, h = cached
+        if n <= len(masks) and len(state['cnt2']) == len(c_masks) and history_hash(masks[:n]) == h:
+            start = n
+    if start == 0:
+        state = new_state(len(c_masks))
+    update_state(state, c_masks, masks[start:], start)
+    if start < len(masks) or cached is None:
+        save_cache(path, combo_size, pool_size, state, masks)
+    return state, c_masks, len(masks) - start
+
+def final_gap(state, gap_f, last_f, total):
+    '''补上最后一次命中到末期的差值，与 lottery_search.compute_max_gap 的定义一致'''
+    return np.maximum(state[gap_f], total + 1 - np.maximum(state[last_f], 0))
+
+def final_diff(state, last_f, total):
+    last = state[last_f]
+    return np.where(last != -1, total - last, total)
+
+def _top(keys, ok, top_n):
+    '''在 ok 为真的组合中按 keys（主键在前）降序取前 top_n 个下标，同分按排名升序'''
+    idx = np.flatnonzero(ok)
+    order = np.lexsort(tuple(-k[idx].astype(np.int64) for k in reversed(keys)))
+    return idx[order[:top_n]]
+
+def spec_counts(c_masks, masks, spec):
+    '''全部组合在窗口／衰减评分下的六个加权计数（字段同 COUNT_FIELDS），只扫描权重非零的最近几期'''
+    from lottery_search import weight_matrix
+    wmat = weight_matrix([spec], len(masks))
+    first = int(np.flatnonzero(wmat[:, 0])[0]) if wmat[:, 0].any() else len(masks)
+    d_masks = pack_masks(masks[first:], c_masks.shape[1])
+    out = {f: np.zeros(len(c_masks), dtype=np.int64) for f in COUNT_FIELDS}
+    for b in range(0, len(c_masks), block_size):
+        res = score_weights(match_counts(c_masks[b:b + block_size], d_masks), wmat[first:])
+        for f, a in zip(COUNT_FIELDS, res):
+            out[f][b:b + block_size] = a[:, 0]
+    return out
+
+def select(state, c_masks, total, top_n, max_gap_limit, spec='full', masks=None):
+    '''从完整状态直接选出四段结果，形状与 mac_app.main 的 sorted2..sorted5 相同
+
+    排序与 lottery_search.push_item 的全序一致（3星 段以 2星 计数为第三键，同分按排名升序），结果与全量模式逐位相同。
+
+    spec 不是 full 时排序与计数栏改用 masks 最近几期的窗口／衰减计数（见 lottery_search.parse_score）。
+    '''
+    s = state
+    c = s if spec == 'full' else spec_counts(c_masks, masks, spec)
+    gap2 = final_gap(s, 'gap2', 'last2', total)
+    gap3 = final_gap(s, 'gap3', 'last3', total)
+    gap4 = final_gap(s, 'gapE4', 'lastE4', total)
+    gap5 = final_gap(s, 'gapE5', 'lastE5', total)
+    diff2 = final_diff(s, 'last2', total)
+    diff3 = final_diff(s, 'last3', total)
+    diff4 = final_diff(s, 'lastE4', total)
+    diff5 = final_diff(s, 'lastE5', total)
+
+    def rows(idx, counts, rest):
+        from lottery_search import score_value
+        return [(mask_to_combo(unpack_mask(c_masks[i])),)
+                + tuple(int(a[i]) if spec == 'full' else score_value(spec, int(a[i])) for a in counts)
+                + tuple(int(a[i]) for a in rest) for i in idx]
+
+    i2 = _top((c['cnt2'], c['cnt3'], c['cnt4']), gap2 <= max_gap_limit, top_n)
+    i3 = _top((c['cnt3'], c['cnt4'], c['cnt2']), gap3 <= max_gap_limit, top_n)
+    i4 = _top((c['cntE4'],), gap4 <= max_gap_limit, top_n)
+    i5 = _top((c['cntE5'],), gap5 <= max_gap_limit, top_n)
+    sorted2 = rows(i2, (c['cnt2'], c['cnt3'], c['cnt4'], c['cnt5']), (diff2, gap2))
+    sorted3 = rows(i3, (c['cnt3'], c['cnt4'], c['cnt5']), (diff3, gap3))
+    sorted4 = rows(i4, (c['cntE4'], c['cnt5']), (diff4, gap4))
+    sorted5 = rows(i5, (c['cntE5'],), (diff5, gap5))
+    return sorted2, sorted3, sorted4, sorted5
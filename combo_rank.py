@@ -0,0 +1,53 @@
+'''组合的紧凑表示：colex 排名（组合数系统）与整数位元掩码之间的互相转换
+
+组合 {b1 < b2 < ... < bk}（号码从 0 起算的位号）的 colex 排名为 Σ C(bi, i)。
+按排名递增枚举恰好就是按掩码数值递增枚举，因此一个排名区间 [start, end)
+只需 unrank 起点，再用 Gosper's hack 逐个取下一个掩码，无需生成元组列表。
+'''
+from math import comb
+
+def combo_to_mask(combo):
+    '''号码组合（号码从 1 起算）→ 掩码'''
+    m = 0
+    for n in combo:
+        m |= 1 << (n - 1)
+    return m
+
+def mask_to_combo(m):
+    out = []
+    while m:
+        low = m & -m
+        out.append(low.bit_length())
+        m ^= low
+    return tuple(out)
+
+def unrank_mask(r, k):
+    '''colex 排名 → 掩码'''
+    m = 0
+    for i in range(k, 0, -1):
+        b = i - 1
+        while comb(b + 1, i) <= r:
+            b += 1
+        r -= comb(b, i)
+        m |= 1 << b
+    return m
+
+def next_mask(m):
+    '''Gosper's hack：同样位数的下一个更大的掩码（即 colex 次序的下一个组合）'''
+    c = m & -m
+    r = m + c
+    return (((r ^ m) >> 2) // c) | r
+
+def iter_masks(start, end, k):
+    '''依次产生排名 start..end-1 的组合掩码'''
+    if start >= end:
+        return
+    m = unrank_mask(start, k)
+    for _ in range(end - start - 1):
+        yield m
+        m = next_mask(m)
+    yield m
+
+def rank_ranges(total, size):
+    '''把 [0, total) 切成长度为 size 的排名区间，作为发给子进程的工作单元'''
+    return [(s, min(s + size, total)) for s in range(0, total, size)]
@@ -0,0 +1,70 @@
+'''开奖历史的期数位集索引：每个号码一个大整数位集（第 i 位代表第 i+1 期），每份历史只建一次
+
+组合 S 的「命中 ≥t 个号码的期」位集满足递推
+    ≥t(S ∪ {x}) = ≥t(S) | (≥t−1(S) & 号码 x 的位集)，≥0 为全部期
+展开即：≥2 是 S 中各号码对位集之并，≥3 是各三元组位集之并，依此类推。号码对／三元组的位集不另存表
+（三元组表在大号码池下每个进程要几十 MB），而是沿 colex 前缀深度优先逐层递推：前缀的位集为其下
+全部组合共用，叶子只需几次大整数与／或加上 bit_count，计数与逐期循环逐位相同。
+'''
+
+def number_bits(masks, width):
+    '''掩码列表 → 长度 width 的列表，第 b 项为掩码第 b 位为 1 的期的位集'''
+    rows = [[] for _ in range(width)]
+    for i, m in enumerate(masks):
+        while m:
+            low = m & -m
+            b = low.bit_length() - 1
+            if b < width:
+                rows[b].append(i)
+            m ^= low
+    nbytes = (len(masks) + 7) // 8
+    bits = []
+    for idx in rows:
+        buf = bytearray(nbytes)
+        for i in idx:
+            buf[i >> 3] |= 1 << (i & 7)
+        bits.append(int.from_bytes(buf, 'little'))
+    return bits
+
+def start_levels(total, top):
+    '''空组合的各门槛位集 [≥0, ≥1, …, ≥top]'''
+    return [(1 << total) - 1] + [0] * top
+
+def extend(levels, x):
+    '''把位集为 x 的号码加入组合后的各门槛位集'''
+    return [levels[0]] + [levels[t] | (levels[t - 1] & x) for t in range(1, len(levels))]
+
+def combo_levels(bits, positions, total, top):
+    '''任意组合（位号列表）的 [≥0, …, ≥top] 位集'''
+    levels = start_levels(total, top)
+    for b in positions:
+        levels = extend(levels, bits[b])
+    return levels
+
+def histogram(bits, positions, total):
+    '''命中数分布：hist[j] 为恰好命中 j 个号码的期数（与 find_test.hit_histogram 相同）'''
+    positions = sorted(set(positions))
+    counts = [x.bit_count() for x in combo_levels(bits, positions, total, len(positions))] + [0]
+    return [counts[j] - counts[j + 1] for j in range(len(positions) + 1)]
+
+def max_gap(x, total):
+    '''相邻命中间隔的最大值，含首末两端（与 lottery_search.compute_max_gap 相同）
+
+    在第 0 期与第 total+1 期各补一个哨兵位，最大间隔即最长的连续 0 加 1。
+    '''
+    y = (x << 1) | 1 | (1 << (total + 1))
+    return max(map(len, bin(y)[3:].split('1'))) + 1
+
+def window_count(x, total, n):
+    '''最近 n 期内的命中期数'''
+    return (x >> (total - n)).bit_count() if n < total else x.bit_count()
+
+def weighted_count(x, weights, first):
+    '''命中期的权重和；weights 为第 1..total 期的权重（下标 0 不用），first 之前的期权重为 0'''
+    x >>= first
+    s = 0
+    while x:
+        low = x & -x
+        s += weights[first + low.bit_length()]
+        x ^= low
+    return s
@@ -0,0 +1,148 @@
+'''开奖历史的二进制存档：每期一个定宽掩码，可直接 mmap，不必每次从工作簿解析
+
+文件布局（小端）：
+    0    4s   魔数 b'LDRW'
+    4    H    版本
+    6    H    号码池大小
+    8    H    每期读取的号码个数
+    10   H    每个掩码的 uint64 字数
+    12   I    最后一期在来源表中的列号（仅供查看）
+    16   Q    期数
+    24   20s  内容哈希：逐期链式 sha1，追加时接着算，与分几次写入无关
+    44   20s  来源指纹：来源表部件与 sharedStrings 在 zip 中的 CRC 与大小
+    64   20s  读取规则（表名、范围、解析方式）的 sha1
+    84   I    超出号码池而被丢弃的号码个数（沿用存档时照样提示）
+    128  ...  期数 × 字数 个 uint64（低位字在前，与 lottery_search.pack_words 相同）
+
+同步时先比对来源指纹（只读 zip 目录，不解析工作表），相符就直接映射，耗时与工作簿大小无关；
+不符时从头重读来源表，已存的前 count 期链式哈希相符（旧期数都没改）才只追加新期数，否则全量重建。
+'''
+import os
+import mmap
+import struct
+import hashlib
+
+from lottery_search import build_masks, mask_words, pack_words
+
+STORE_VERSION = 2
+MAGIC = b'LDRW'
+HEADER = struct.Struct('<4sHHHHIQ20s20s20sI')
+HEADER_SIZE = 128
+
+def rule_hash(rule):
+    return hashlib.sha1(rule.encode('utf-8')).digest()
+
+def default_store_path(file_path, rule):
+    '''<工作簿>.<规则哈希前 8 位>.draws：不同的表、范围或解析方式各存一份，互不覆盖'''
+    return os.path.splitext(file_path)[0] + f'.{rule_hash(rule).hex()[:8]}.draws'
+
+def source_stamp(file_path, sheet=None):
+    '''来源表（None 为第一张）部件与 sharedStrings 的 (CRC, 大小) 指纹；无法辨识时返回 None（视为已变动）'''
+    import zipfile
+    import xlsm_io
+    try:
+        with zipfile.ZipFile(file_path) as z:
+            parts = [xlsm_io.sheet_part(z, sheet), 'xl/sharedStrings.xml']
+            infos = [z.getinfo(p) for p in parts if p in z.NameToInfo]
+    except (OSError, KeyError, StopIteration, zipfile.BadZipFile):
+        return None
+    return hashlib.sha1(repr([(i.filename, i.CRC, i.file_size) for i in infos]).encode()).digest()
+
+def chain_hash(h, flat, words):
+    '''把 flat（pack_words 的输出）逐期并入链式哈希'''
+    raw = flat.tobytes()
+    step = 8 * words
+    for i in range(0, len(raw), step):
+        h = hashlib.sha1(h + raw[i:i + step]).digest()
+    return h
+
+def read_header(path):
+    '''读取文件头，返回 dict；不存在、损坏、版本不符或数据比期数短（被截断）时返回 None'''
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read(HEADER.size)
+            size = os.fstat(f.fileno()).st_size
+    except OSError:
+        return None
+    if len(raw) < HEADER.size:
+        return None
+    magic, version, pool, pick, words, last_row, count, h, stamp, rule, dropped = HEADER.unpack(raw)
+    if magic != MAGIC or version != STORE_VERSION or size < HEADER_SIZE + 8 * words * count:
+        return None
+    return {'pool': pool, 'pick': pick, 'words': words, 'last_row': last_row, 'count': count,
+            'hash': h, 'stamp': stamp, 'rule': rule, 'dropped': dropped}
+
+def pack_header(hdr):
+    raw = HEADER.pack(MAGIC, STORE_VERSION, hdr['pool'], hdr['pick'], hdr['words'], hdr['last_row'],
+                      hdr['count'], hdr['hash'], hdr['stamp'] or bytes(20), hdr['rule'], hdr['dropped'])
+    return raw.ljust(HEADER_SIZE, b'\0')
+
+def map_masks(path, n_words):
+    '''以唯读 mmap 映射存档，返回 (mmap, 'Q' 格式的 memoryview)；同一文件在各进程间共用页缓存'''
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return mm, memoryview(mm).cast('Q')[HEADER_SIZE // 8:HEADER_SIZE // 8 + n_words]
+
+def load_masks(path, count, words):
+    '''存档前 count 期 → Python int 掩码列表（与 lottery_search.build_masks 的结果相同）'''
+    if not count:
+        return []
+    mm, view = map_masks(path, count * words)
+    try:
+        flat = view.tolist()
+    finally:
+        view.release()
+        mm.close()
+    if words == 1:
+        return flat
+    return [sum(flat[i + w] << (64 * w) for w in range(words)) for i in range(0, len(flat), words)]
+
+def write_store(path, hdr, flat):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(pack_header(hdr))
+        f.write(flat.tobytes())
+    os.replace(tmp, path)
+
+def append_store(path, hdr, start, flat):
+    '''第 start 期之后的新掩码接在原有数据之后，再改写文件头；已映射旧长度的进程不受影响'''
+    with open(path, 'r+b') as f:
+        f.seek(HEADER_SIZE + 8 * hdr['words'] * start)
+        f.write(flat.tobytes())
+        f.seek(0)
+        f.write(pack_header(hdr))
+
+def sync_store(path, file_path, sheet, rule, pool_size, pick, read_rows):
+    '''使存档与工作簿一致，返回 (掩码列表, 本次写入存档的期数, 超出号码池而被丢弃的号码个数)
+
+    read_rows() 从头逐行产生 (列号, 号码列表)；只有来源指纹不符时才会调用。
+    '''
+    words = mask_words(pool_size)
+    stamp = source_stamp(file_path, sheet)
+    want = {'pool': pool_size, 'pick': pick, 'words': words, 'rule': rule_hash(rule)}
+    hdr = read_header(path)
+    if hdr is not None and any(hdr[k] != v for k, v in want.items()):
+        hdr = None
+    if hdr is not None and stamp is not None and hdr['stamp'] == stamp:
+        return load_masks(path, hdr['count'], words), 0, hdr['dropped']
+
+    rows = list(read_rows())
+    masks, dropped = build_masks([nums for _, nums in rows], pool_size)
+    start = 0
+    if hdr is not None and hdr['count']:
+        start = hdr['count']
+        # 旧期数任何一期被改动（不只最后一期）都会使链式哈希不同
+        if len(masks) < start or chain_hash(bytes(20), pack_words(masks[:start], words), words) != hdr['hash']:
+            print(f'开奖存档 {path} 与工作簿的已存期数不符，重新建立')
+            hdr, start = None, 0
+
+    flat = pack_words(masks[start:], words)
+    if hdr is None:
+        hdr = dict(want, count=0, hash=bytes(20))
+    hdr.update(stamp=stamp, count=len(masks), hash=chain_hash(hdr['hash'], flat, words),
+               last_row=rows[-1][0] if rows else 0, dropped=dropped)
+    if start:
+        append_store(path, hdr, start, flat)
+    else:
+        write_store(path, hdr, flat)
+    return masks, len(masks) - start, dropped
@@ -2,11 +2,38 @@ import sys
 import os
 import re
 import subprocess
-import openpyxl
-from openpyxl.utils import column_index_from_string
-from openpyxl.styles import Alignment
-import tkinter as tk
-from tkinter import messagebox
+from multiprocessing import Pool, cpu_count, freeze_support
+import xlsm_io
+
+# 為 True（--headless）時不彈出對話框、不關閉／重開 Excel，訊息改印在終端
+headless = False
+# 開獎存檔（draw_store）；'' 表示放在活頁簿旁，None（預設）則每次直接從原始表讀取
+store_path = None
+# 回測引擎：loop（逐期比對）或 index（draw_index 的期數位集，計數相同）
+engine = 'loop'
+# 命中分佈快取；'' 表示放在活頁簿旁（<活頁簿>.hist.json），None（預設）不快取
+memo_path = None
+memo_histories = 8      # 快取檔中保留最近幾份開獎歷史（例如不同範圍）的分佈
+
+# 四個號碼段各自回測的門檻：(欄名, 命中數, 是否恰好命中)
+SECTION_THRESHOLDS = [
+    [("2星", 2, False), ("3星", 3, False), ("4星", 4, False), ("5星", 5, True)],
+    [("3星", 3, False), ("4星", 4, False), ("5星", 5, True)],
+    [("4星", 4, False), ("5星", 5, True)],
+    [("5星", 5, True)]
+]
+
+def notify(title, text, error=False):
+    """有圖形介面時以對話框顯示訊息，headless 時印在終端"""
+    if headless:
+        print(f"{title}：{text}")
+        return
+    import tkinter as tk
+    from tkinter import messagebox
+    root = tk.Tk()
+    root.withdraw()
+    (messagebox.showerror if error else messagebox.showinfo)(title, text)
+    root.destroy()
 
 def close_excel_workbook(file_path):
     """嘗試關閉已開啟的 Excel 活頁簿，確保檔案可供寫入"""
@@ -41,35 +68,41 @@ def reopen_excel_workbook(file_path):
         script = f'tell application "Microsoft Excel" to open POSIX file "{os.path.abspath(file_path)}"'
         subprocess.run(['osascript', '-e', script], check=False)
 
-def detect_combo_size(ws):
+def detect_combo_size(header):
     size = 0
-    while ws.cell(1, size+1).value == f"號碼{size+1}":
+    while size < len(header) and header[size] == f"號碼{size+1}":
         size += 1
     return size
 
-def read_draws(ws, col_range):
+def parse_col_range(col_range):
+    """'B:F' 或 'B2:F100' → (首欄, 末欄, 首列, 末列或 None)；首列預設為 2（第 1 列為表頭）"""
     m = re.match(r'^([A-Za-z]+)(\d*):([A-Za-z]+)(\d*)$', col_range)
     if not m:
         raise ValueError(f"不支援的欄位範圍格式：{col_range}")
     c1, r1_str, c2, r2_str = m.groups()
-    c1_i = column_index_from_string(c1)
-    c2_i = column_index_from_string(c2)
-    r1 = int(r1_str) if r1_str else 2
-    r2 = int(r2_str) if r2_str else ws.max_row
-    draws = []
-    for row in ws.iter_rows(min_row=r1, max_row=r2, min_col=c1_i, max_col=c2_i, values_only=True):
+    return (xlsm_io.col_index(c1), xlsm_io.col_index(c2),
+            int(r1_str) if r1_str else 2, int(r2_str) if r2_str else None)
+
+def iter_draws(ws, col_range):
+    """逐列產生 (列號, 號碼)；整列皆空的列略過"""
+    c1, c2, r1, r2 = parse_col_range(col_range)
+    rows = ws.iter_rows(min_row=r1, max_row=r2 or ws.max_row, min_col=c1, max_col=c2, values_only=True)
+    for r, row in enumerate(rows, r1):
         if any(row):
-            draws.append([int(v) for v in row if v is not None])
-    return draws
+            yield r, [int(v) for v in row if v is not None]
 
-def read_section_combos(ws, start_col, combo_size):
+def read_draws(ws, col_range):
+    return [d for _, d in iter_draws(ws, col_range)]
+
+def read_section_combos(rows, start_col, combo_size):
+    """rows 為排列表第 2 列起的值（iter_rows(values_only=True)），start_col 從 1 起算"""
     combos = []
-    end_col = start_col + combo_size - 1
-    for row in ws.iter_rows(min_row=2, max_row=ws.max_row,
-                            min_col=start_col, max_col=end_col,
-                            values_only=True):
-        if all(v is not None for v in row):
-            combos.append(tuple(int(v) for v in row))
+    lo = start_col - 1
+    hi = lo + combo_size
+    for row in rows:
+        vals = row[lo:hi]
+        if len(vals) == combo_size and all(v is not None for v in vals):
+            combos.append(tuple(int(v) for v in vals))
     return combos
 
 def count_hits(draws, combo, threshold, exact=False):
@@ -80,69 +113,249 @@ def count_hits(draws, combo, threshold, exact=False):
             cnt += 1
     return cnt
 
-def write_section(ws, combo_size, draws, combos, thresholds, start_col):
+# 組合數 × 期數超過此值時，區段回測改用多行程
+parallel_threshold = 20_000_000
+_pool_masks = []
+_index = (None, [])     # index 引擎：(建立時的 masks, 逐號碼期數位集)，同一份歷史只建一次
+
+def draw_masks(draws):
+    """每期號碼 → 位元遮罩（第 v 位代表號碼 v），與 set 交集的命中數完全一致"""
+    masks = []
+    for d in draws:
+        m = 0
+        for v in d:
+            m |= 1 << v
+        masks.append(m)
+    return masks
+
+def hit_histogram(masks, combo):
+    """一個組合對全部期數的命中數分佈：hist[j] 為恰好命中 j 個的期數"""
+    m = 0
+    for v in combo:
+        m |= 1 << v
+    hist = [0] * (m.bit_count() + 1)
+    for lm in masks:
+        hist[(m & lm).bit_count()] += 1
+    return hist
+
+def hits_from_histogram(hist, threshold, exact=False):
+    """由命中數分佈得出與 count_hits 相同的計數"""
+    if exact:
+        return hist[threshold] if threshold < len(hist) else 0
+    return sum(hist[threshold:])
+
+def _init_hist_pool(masks):
+    """masks 為 (存檔路徑, 期數, 字數) 時各行程直接映射開獎存檔，共用同一份頁快取"""
+    global _pool_masks
+    if isinstance(masks, tuple):
+        import draw_store
+        masks = [m << 1 for m in draw_store.load_masks(*masks)]
+    _pool_masks = masks
+
+def _hist_chunk(combos):
+    return [hit_histogram(_pool_masks, c) for c in combos]
+
+def index_bits(masks, combos):
+    """index 引擎的逐號碼期數位集（第 v 項為開出號碼 v 的期）；masks 不變時沿用上次建立的索引"""
+    global _index
+    import draw_index
+    width = max([m.bit_length() for m in masks] + [max(c) + 1 for c in combos if c])
+    if _index[0] is not masks or len(_index[1]) < width:
+        _index = (masks, draw_index.number_bits(masks, width))
+    return _index[1]
+
+def section_histograms(masks, combos, store=None):
+    """計算一個區段全部組合的命中數分佈；量大時分塊交給行程池
+
+    store 為 masks 所來自的開獎存檔 (存檔路徑, 期數, 字數)，給出時行程池自行映射存檔，不必傳送 masks。
+    """
+    if engine == 'index':
+        # 每個組合只需幾次大整數運算，單一行程即可，省下開行程池的時間
+        import draw_index
+        bits = index_bits(masks, combos)
+        return [draw_index.histogram(bits, c, len(masks)) for c in combos]
+    workers = cpu_count()
+    if len(combos) * len(masks) < parallel_threshold or workers < 2:
+        return [hit_histogram(masks, c) for c in combos]
+    size = max(1, -(-len(combos) // (workers * 4)))
+    with Pool(workers, initializer=_init_hist_pool, initargs=(store or masks,)) as pool:
+        parts = pool.map(_hist_chunk, [combos[i:i+size] for i in range(0, len(combos), size)])
+    return [h for part in parts for h in part]
+
+def history_hash(masks):
+    """開獎遮罩序列的內容雜湊（算法同 combo_cache.history_hash），作為分佈快取的鍵"""
+    import hashlib
+    return hashlib.sha1(','.join(map(str, masks)).encode()).hexdigest()
+
+def combo_key(combo):
+    """命中分佈只與號碼集合有關：排序、去除重複後的號碼元組"""
+    return tuple(sorted(set(combo)))
+
+def default_memo_path(path):
+    return os.path.splitext(path)[0] + '.hist.json'
+
+def read_memo(mpath):
+    """快取檔 → {'histories': {歷史雜湊: {"1,2,3": 分佈}}}；不存在或損壞時為空"""
+    import json
+    try:
+        with open(mpath, encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data.get('histories'), dict):
+            return data
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {'histories': {}}
+
+def write_memo(mpath, data):
+    import json
+    tmp = mpath + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp, mpath)
+
+def unique_histograms(masks, section_combos, mpath=None, store=None):
+    """各段組合合併去重後只算一次命中分佈，返回 {combo_key: 分佈}
+
+    給出 mpath 時先從快取中取出同一開獎歷史已算過的分佈，其餘（量大時經由行程池）計算後併入快取；
+    快取依歷史雜湊分開存放，只保留最近 memo_histories 份。store 同 section_histograms。
+    """
+    keys = list(dict.fromkeys(combo_key(c) for combos in section_combos for c in combos))
+    table, data, h, was_last = {}, None, None, False
+    if mpath:
+        h = history_hash(masks)
+        data = read_memo(mpath)
+        was_last = next(reversed(data['histories']), None) == h
+        table = data['histories'].pop(h, {})
+    hists = {}
+    for k in keys:
+        s = ','.join(map(str, k))
+        if s in table:
+            hists[k] = table[s]
+    missing = [k for k in keys if k not in hists]
+    hists.update(zip(missing, section_histograms(masks, missing, store)))
+    total = sum(len(combos) for combos in section_combos)
+    print(f"回測組合 {total} 個，去重後 {len(keys)} 個" +
+          (f"，快取命中 {len(keys) - len(missing)} 個" if mpath else "") + f"，本次計算 {len(missing)} 個")
+    if mpath:
+        table.update((','.join(map(str, k)), hists[k]) for k in missing)
+        data['histories'][h] = table     # 重新放到最後，作為最近使用
+        while len(data['histories']) > memo_histories:
+            data['histories'].pop(next(iter(data['histories'])))
+        # 全部命中且本來就是最近使用的一份時，快取內容不變，不必重寫
+        if missing or not was_last:
+            write_memo(mpath, data)
+    return hists
+
+def _put(grid, i, j, values):
+    """把 values 填入 grid 第 i 列（從 0 起算）、第 j 欄起（從 1 起算），不足處補 None"""
+    while len(grid) <= i:
+        grid.append([])
+    row = grid[i]
+    end = j - 1 + len(values)
+    if len(row) < end:
+        row.extend([None] * (end - len(row)))
+    row[j-1:end] = values
+
+def write_section(grid, combo_size, masks, combos, thresholds, start_col, hists=None):
+    """hists 為 unique_histograms 的結果；省略時就地計算本段的分佈"""
     headers = [f"號碼{i}" for i in range(1, combo_size+1)] + [name for name, *_ in thresholds]
-    for j, h in enumerate(headers, start=start_col):
-        ws.cell(1, j, h).alignment = Alignment(horizontal="center")
-    for i, combo in enumerate(combos, start=2):
-        for k, num in enumerate(combo, start=start_col):
-            ws.cell(i, k, num).alignment = Alignment(horizontal="center")
-        for idx, (_, thr, exact) in enumerate(thresholds, start=1):
-            col = start_col + combo_size + idx - 1
-            ws.cell(i, col, count_hits(draws, combo, thr, exact)).alignment = Alignment(horizontal="center")
+    _put(grid, 0, start_col, headers)
+    if hists is None:
+        hists = dict(zip(map(combo_key, combos), section_histograms(masks, combos)))
+    for i, combo in enumerate(combos, start=1):
+        hist = hists[combo_key(combo)]
+        hits = [hits_from_histogram(hist, thr, exact) for _, thr, exact in thresholds]
+        _put(grid, i, start_col, list(combo) + hits)
+
+def store_masks(path, draws_sheet, col_range, pool):
+    """經由開獎存檔取得 (掩碼, (存檔路徑, 期數, 字數))；掩碼中號碼 v 為第 v 位，與 draw_masks 相同
+
+    原始表未變動時不解析活頁簿。
+    """
+    import draw_store
+    c1, c2, _, _ = parse_col_range(col_range)
+    rule = f'find_test|{draws_sheet}|{col_range}|{pool}'
+    spath = store_path or draw_store.default_store_path(path, rule)
+
+    def read_rows():
+        wb = xlsm_io.open_readonly(path)
+        try:
+            yield from iter_draws(wb[draws_sheet], col_range)
+        finally:
+            wb.close()
+
+    masks, scanned, _ = draw_store.sync_store(spath, path, draws_sheet, rule, pool, c2 - c1 + 1, read_rows)
+    print(f"開獎存檔：{spath}，本次寫入 {scanned}/{len(masks)} 期")
+    # 存檔中號碼 v 在第 v-1 位；號碼池外的號碼不會出現在任何組合裡，捨去不影響命中數
+    return [m << 1 for m in masks], (spath, len(masks), draw_store.mask_words(pool))
 
 def main(path, draws_sheet, col_range, prize_sheet):
+    """回測並寫回「回測結果」表；成功時返回 None，無法回測時顯示訊息並返回錯誤文字"""
     if not os.path.exists(path):
-        messagebox.showerror("錯誤", "找不到檔案")
-        return
-    close_excel_workbook(path)
-    wb = openpyxl.load_workbook(path, keep_vba=True)
-    ws_draws = wb[draws_sheet]
-    ws_prize = wb[prize_sheet]
-
-    M = detect_combo_size(ws_prize)
-    draws = read_draws(ws_draws, col_range)
+        notify("錯誤", "找不到檔案", error=True)
+        return f"找不到檔案：{path}"
+    if not headless:
+        close_excel_workbook(path)
+    timer = xlsm_io.Timer()
+    with timer('讀取'):
+        wb = xlsm_io.open_readonly(path)
+        draws = read_draws(wb[draws_sheet], col_range) if store_path is None else None
+        prize = list(wb[prize_sheet].iter_rows(values_only=True))
+        wb.close()
+    header = prize[0] if prize else ()
+    M = detect_combo_size(header)
 
-    starts = [col for col in range(1, ws_prize.max_column+1)
-              if ws_prize.cell(1, col).value == '號碼1']
+    starts = [col for col, v in enumerate(header, start=1) if v == '號碼1']
     if len(starts) < 4:
-        messagebox.showerror("錯誤", f"偵測到 {len(starts)} 個號碼段，無法回測四段。")
-        return
+        error = f"偵測到 {len(starts)} 個號碼段，無法回測四段。"
+        notify("錯誤", error, error=True)
+        return error
     starts.sort()
-    config = [
-        [("2星", 2, False), ("3星", 3, False), ("4星", 4, False), ("5星", 5, True)],
-        [("3星", 3, False), ("4星", 4, False), ("5星", 5, True)],
-        [("4星", 4, False), ("5星", 5, True)],
-        [("5星", 5, True)]
-    ]
+    section_combos = [read_section_combos(prize[1:], start_col, M) for start_col in starts[:4]]
 
-    if "回測結果" in wb.sheetnames:
-        del wb["回測結果"]
-    ws_result = wb.create_sheet("回測結果", index=len(wb.sheetnames))
+    if draws is not None:
+        masks, store = draw_masks(draws), None
+    else:
+        # 號碼池至少 39，組合中有更大的號碼時隨之放大
+        pool = max([39] + [max(c) for combos in section_combos for c in combos if c])
+        with timer('存檔'):
+            masks, store = store_masks(path, draws_sheet, col_range, pool)
 
-    for start_col, thresholds in zip(starts[:4], config):
-        combos = read_section_combos(ws_prize, start_col, M)
-        write_section(ws_result, M, draws, combos, thresholds, start_col)
+    grid = []
+    sections = []
+    with timer('回測'):
+        hists = unique_histograms(masks, section_combos,
+                                  None if memo_path is None else memo_path or default_memo_path(path), store)
+        for start_col, combos, thresholds in zip(starts[:4], section_combos, SECTION_THRESHOLDS):
+            write_section(grid, M, masks, combos, thresholds, start_col, hists)
+            sections.append((start_col, M + len(thresholds)))
+    blocks = xlsm_io.section_blocks(sections, M)
 
-    try:
-        wb.save(path)
-    except PermissionError:
-        close_excel_workbook(path)
-        wb.save(path)
-    reopen_excel_workbook(path)
+    with timer('寫回'):
+        try:
+            xlsm_io.replace_sheet(path, "回測結果", grid, blocks=blocks)
+        except PermissionError:
+            if headless:
+                raise
+            close_excel_workbook(path)
+            xlsm_io.replace_sheet(path, "回測結果", grid, blocks=blocks)
+    timer.report()
+    if not headless:
+        reopen_excel_workbook(path)
 
     # 顯示完成訊息
-    root = tk.Tk()
-    root.withdraw()
-    messagebox.showinfo("回測完成", "所有回測區段已成功完成！")
-    root.destroy()
+    notify("回測完成", "所有回測區段已成功完成！")
 
 if __name__ == '__main__':
-    # GUI 入口
-    root = tk.Tk()
-    root.withdraw()
-    if len(sys.argv) != 5:
-        messagebox.showinfo("使用說明", "用法：python backtest_sections.py <檔案> <原始表> <範圍> <排列表>")
+    freeze_support()
+    # GUI 入口；加上 --headless 則不使用任何視窗與 Excel 自動化，--store[=路徑] 使用開獎存檔，--engine=index 改用位集索引，--memo[=路徑] 快取命中分佈
+    args, flags = xlsm_io.split_options(sys.argv[1:])
+    headless = 'headless' in flags
+    store_path = flags.get('store')
+    engine = flags.get('engine') or engine
+    memo_path = flags.get('memo')
+    if len(args) != 4 or engine not in ('loop', 'index'):
+        notify("使用說明", "用法：python find_test.py <檔案> <原始表> <範圍> <排列表> [--headless] [--store[=路徑]] [--engine=loop|index] [--memo[=路徑]]")
         sys.exit(1)
-    _, path, draws_sheet, col_range, prize_sheet = sys.argv
-    main(path, draws_sheet, col_range, prize_sheet)
\ No newline at end of file
+    path, draws_sheet, col_range, prize_sheet = args
+    sys.exit(1 if main(path, draws_sheet, col_range, prize_sheet) else 0)
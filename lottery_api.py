@@ -0,0 +1,307 @@
+'''无界面的程序接口与命令行：不依赖 Tk、消息框或 Excel 自动化
+
+    search(draws, pool, combo_size, top_n, max_gap, score) → 四段（2星／3星／4星／5星）排行
+    backtest(draws, sections)                        → 各号码段的回测命中数
+    batch(draws, configs, pool)                      → 多组 (combo_size, top_n, max_gap, score) 各一份排行，
+                                                       同一组合大小只计分一次，每期取号个数相同的配置共用一个进程池
+search 与 batch 每期只取前 pick 个号码，pick 省略时为组合大小（与 mac_app、lottery_server 相同），
+因此同一配置在 search、batch 与服务端得到相同的排行。
+
+命令行读取 CSV/XLSX 开奖历史，结果写成 CSV、JSON 或 Parquet（依 --out 的扩展名，省略时 JSON 输出到终端）：
+    python lottery_api.py search <开奖文件> <combo_size> [--top=200] [--gap=N] [--pool=39] [--pick=N]
+                                 [--cols=B:F] [--sheet=名称] [--engine=loop|numpy|bnb|index] [--cache=路径] [--out=结果.csv]
+                                 [--score=full|w<N>|d<H>]
+    python lottery_api.py backtest <开奖文件> <排列文件> [--cols=B:F] [--sheet=名称] [--sections-sheet=名称]
+                                   [--engine=loop|index] [--out=结果.csv]
+    python lottery_api.py batch <开奖文件> <配置文件.json|.csv> [--pool=39] [--pick=N] [--cols=B:F] [--sheet=名称]
+                                [--engine=loop|numpy|bnb|index] [--cache=路径] [--out=目录] [--format=csv|json|parquet]
+配置文件为 JSON 列表（[{"combo_size": 5, "top_n": 200, "max_gap": 300, "score": "w100"}, ...]）或含同名表头的 CSV/XLSX，
+max_gap 省略或留空表示不过滤，score 省略为 full（评分方式见 lottery_search.parse_score）；每期读取 --cols 范围内的前 --pick 个号码（省略时为组合大小），
+每组配置输出一个文件 c<组合大小>_top<N>_gap<差值|all>[_<评分>].<格式>，省略 --out 时以 JSON 输出到终端。
+
+mac_app（Tk 终端 + 工作簿）与 find_test（对话框 + 工作簿）只是在这些功能外面加上界面与 Excel 读写。
+'''
+import os
+import sys
+import csv
+import json
+import contextlib
+from multiprocessing import freeze_support
+
+import lottery_search
+from xlsm_io import split_options
+
+# 各段的统计栏位，与「獲獎排列」表头一致（4星段的“4星”为精确 4 星，5星段的“5星”为精确 5 星）
+SEARCH_COLUMNS = {
+    '2星': ['2星', '3星', '4星', '5星', '未開', '最大差值'],
+    '3星': ['3星', '4星', '5星', '未開', '最大差值'],
+    '4星': ['4星', '5星', '未開', '最大差值'],
+    '5星': ['5星', '未開', '最大差值'],
+}
+
+def pick_draws(draws, pick):
+    '''每期只取前 pick 个号码，不足 pick 个的期略过'''
+    return [d[:pick] for d in draws if len(d) >= pick]
+
+def search(draws, pool=39, combo_size=5, top_n=200, max_gap=None, engine='loop', cache=None, score='full', pick=None):
+    '''对 1..pool 中全部 combo_size 个号码的组合计分，返回 {段名: [{'號碼': [...], 栏位: 值, ...}, ...]}
+
+    draws 为每期开出的号码列表，每期只取前 pick 个（默认组合大小）；max_gap 为 None 时不按最大差值过滤；
+    cache 为增量缓存路径（.npz，或作为缓存文件名基准的任意路径）；score 为排序与计数栏所用的评分方式。
+    被取消时返回 None。
+    '''
+    if not 1 <= combo_size <= pool:
+        raise ValueError(f'组合大小必须在 1..{pool} 之间')
+    ls = lottery_search
+    ls.pool_size = pool
+    ls.top_n = top_n
+    ls.max_gap_limit = 1000000 if max_gap is None else max_gap
+    ls.engine = engine
+    ls.score_mode = score = ls.parse_score(score)
+    masks, dropped = ls.build_masks(pick_draws(draws, pick or combo_size), pool)
+    if dropped:
+        print(f'警告：有 {dropped} 个号码不在 1..{pool} 内，已忽略')
+    if cache is not None:
+        found = ls.search_cached(masks, combo_size, cache)
+    else:
+        found = ls.search_full(masks, combo_size)
+    if found is None:
+        return None
+    return to_records(found, score)
+
+def score_columns(cols, score='full'):
+    '''计数栏（未開、最大差值以外）加上评分方式的后缀'''
+    label = lottery_search.score_label(score)
+    return [c if c in ('未開', '最大差值') else c + label for c in cols]
+
+def to_records(found, score='full'):
+    '''search_full 的四段结果 → {段名: [{'號碼': [...], 栏位: 值, ...}, ...]}'''
+    return {name: [dict({'號碼': list(row[0])}, **dict(zip(score_columns(cols, score), row[1:]))) for row in rows]
+            for (name, cols), rows in zip(SEARCH_COLUMNS.items(), found)}
+
+def batch(draws, configs, pool=39, engine='loop', cache=None, pick=None):
+    '''对多组配置（dict：combo_size、top_n、max_gap、score）各选出一份结果，返回与 configs 同序的列表
+
+    每期取前 pick 个号码，pick 为 None 时按各配置的组合大小取（与 search 相同）；取号个数相同的配置
+    共用一份开奖掩码与一个进程池。组合大小相同的配置共用同一趟计分（各评分方式的计数也在这一趟里累计），
+    子进程为每个不同的 (top_n, max_gap, score) 各维护一组小堆，只有选取部分各自进行。
+    给出 cache 时每个组合大小同步一次增量缓存，再按各配置直接选取。被取消时返回 None。
+    '''
+    ls = lottery_search
+    ls.pool_size = pool
+    ls.engine = engine
+    wanted = [(c['combo_size'], c.get('top_n') or 200, 1000000 if c.get('max_gap') is None else c['max_gap'],
+               ls.parse_score(c.get('score'))) for c in configs]
+    for k, _, _, _ in wanted:
+        if not 1 <= k <= pool:
+            raise ValueError(f'组合大小必须在 1..{pool} 之间')
+    by_size = {}
+    for k, n, gap, score in wanted:
+        sel = by_size.setdefault(k, [])
+        if (n, gap, score) not in sel:
+            sel.append((n, gap, score))
+
+    by_pick = {}
+    for k in by_size:
+        by_pick.setdefault(pick or k, []).append(k)
+
+    found = {}
+    for p, sizes in by_pick.items():
+        masks, dropped = ls.build_masks(pick_draws(draws, p), pool)
+        if dropped:
+            print(f'警告：有 {dropped} 个号码不在 1..{pool} 内，已忽略')
+        if cache is not None:
+            import combo_cache
+            for k in sizes:
+                path = cache if cache.endswith('.npz') and len(by_size) == 1 else combo_cache.default_cache_path(cache, k)
+                state, c_masks, scored = combo_cache.sync_cache(path, k, pool, masks)
+                print(f'增量缓存：{path}，本次计分 {scored}/{len(masks)} 期')
+                for n, gap, score in by_size[k]:
+                    found[k, n, gap, score] = combo_cache.select(state, c_masks, len(masks), n, gap, score, masks)
+            continue
+        proc_pool, shm = ls.start_pool(masks)
+        try:
+            for k in sizes:
+                sel = by_size[k]
+                print(f'组合大小 {k}：{len(sel)} 组选取条件共用一趟计分')
+                res = ls.search_multi(proc_pool, k, sel)
+                if res is None:
+                    return None
+                found.update(((k,) + s, r) for s, r in zip(sel, res))
+        finally:
+            ls.stop_pool(proc_pool, shm)
+    return [to_records(found[w], w[3]) for w in wanted]
+
+def read_configs(path):
+    '''批量配置：JSON 列表，或首行为 combo_size／top_n／max_gap（／score）表头的 CSV/XLSX'''
+    if os.path.splitext(path)[1].lower() == '.json':
+        with open(path, encoding='utf-8') as f:
+            configs = json.load(f)
+    else:
+        rows = read_table(path)
+        header = [str(h).strip() if h is not None else '' for h in rows[0]]
+        configs = [dict(zip(header, row)) for row in rows[1:] if any(v is not None for v in row)]
+    out = []
+    for c in configs:
+        gap = c.get('max_gap')
+        out.append({'combo_size': int(c['combo_size']), 'top_n': int(c.get('top_n') or 200),
+                    'max_gap': None if gap in (None, '') else int(gap),
+                    'score': lottery_search.parse_score(c.get('score'))})
+    return out
+
+def config_name(c):
+    gap = 'all' if c['max_gap'] is None else c['max_gap']
+    score = c.get('score') or 'full'
+    return f"c{c['combo_size']}_top{c['top_n']}_gap{gap}" + ('' if score == 'full' else f'_{score}')
+
+def backtest(draws, sections, engine='loop'):
+    '''sections 为至多四段组合列表（依序对应 2星／3星／4星／5星 段），返回 {段名: [{'號碼': [...], 门槛: 命中期数, ...}]}
+
+    engine 为 index 时以 draw_index 的期数位集计数（结果相同）。
+    '''
+    import find_test
+    find_test.engine = engine
+    masks = find_test.draw_masks(draws)
+    # 各段重复的组合只计算一次
+    hists = find_test.unique_histograms(masks, sections)
+    out = {}
+    for combos, thresholds in zip(sections, find_test.SECTION_THRESHOLDS):
+        out[thresholds[0][0]] = [
+            dict({'號碼': list(combo)}, **{name: find_test.hits_from_histogram(hists[find_test.combo_key(combo)], thr, exact)
+                                          for name, thr, exact in thresholds})
+            for combo in combos]
+    return out
+
+def read_table(path, sheet=None):
+    '''CSV 或 XLSX/XLSM 的全部行（值的列表）；CSV 的空字符串视为空白格'''
+    if os.path.splitext(path)[1].lower() == '.csv':
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            return [[v if v != '' else None for v in row] for row in csv.reader(f)]
+    import xlsm_io
+    wb = xlsm_io.open_readonly(path)
+    try:
+        ws = wb[sheet] if sheet else wb[wb.sheetnames[0]]
+        return [list(row) for row in ws.iter_rows(values_only=True)]
+    finally:
+        wb.close()
+
+def draws_from_rows(rows, cols=None):
+    '''从表格行中取出开奖号码：cols 为 'B:F' 形式的栏位范围，含非整数内容的行（表头等）被略过
+
+    每期保留范围内的全部号码，取前几个由 search／batch 的 pick 决定。
+    '''
+    lo, hi = 0, None
+    if cols:
+        from xlsm_io import col_index
+        a, _, b = cols.partition(':')
+        lo = col_index(a) - 1
+        hi = col_index(b or a)
+    draws = []
+    for row in rows:
+        vals = [v for v in row[lo:hi] if v is not None]
+        try:
+            nums = [int(v) for v in vals]
+        except (TypeError, ValueError):
+            continue
+        if nums:
+            draws.append(nums)
+    return draws
+
+def sections_from_rows(rows):
+    '''「獲獎排列」版式（表头每段以 號碼1 开头）的行 → 各段组合列表'''
+    import find_test
+    header = rows[0] if rows else []
+    combo_size = find_test.detect_combo_size(header)
+    starts = [c for c, v in enumerate(header, start=1) if v == '號碼1']
+    return [find_test.read_section_combos(rows[1:], start, combo_size) for start in starts]
+
+def flatten(results):
+    '''{段名: 记录} → 扁平记录列表（段、名次、號碼1..k 与各统计栏位），供 CSV/Parquet 输出'''
+    flat = []
+    for name, rows in results.items():
+        for rank, row in enumerate(rows, start=1):
+            rec = {'段': name, '名次': rank}
+            rec.update({f'號碼{i}': n for i, n in enumerate(row['號碼'], start=1)})
+            rec.update((k, v) for k, v in row.items() if k != '號碼')
+            flat.append(rec)
+    return flat
+
+def write_results(results, path=None):
+    '''依扩展名写成 .csv／.json／.parquet；path 为 None 时以 JSON 输出到 stdout'''
+    ext = os.path.splitext(path)[1].lower() if path else '.json'
+    if ext == '.json':
+        text = json.dumps(results, ensure_ascii=False, indent=1)
+        if path is None:
+            print(text)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return
+    flat = flatten(results)
+    fields = []
+    for rec in flat:
+        fields.extend(k for k in rec if k not in fields)
+    if ext == '.csv':
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            w = csv.DictWriter(f, fieldnames=fields)
+            w.writeheader()
+            w.writerows(flat)
+    elif ext == '.parquet':
+        try:
+            import pandas as pd
+            pd.DataFrame(flat, columns=fields).to_parquet(path, index=False)
+        except ImportError as e:
+            raise SystemExit(f'输出 Parquet 需要 pandas 与 pyarrow：{e}')
+    else:
+        raise SystemExit(f'不支持的输出格式：{ext}（可用 .csv、.json、.parquet）')
+
+def cli(argv):
+    args, opts = split_options(argv)
+    if len(args) < 4 or args[1] not in ('search', 'backtest', 'batch'):
+        print(__doc__)
+        return 1
+    sheet = opts.get('sheet') or None
+    out = opts.get('out') or None
+    # 进度与提示信息改走 stderr，stdout 只留给结果
+    with contextlib.redirect_stdout(sys.stderr):
+        if args[1] == 'search':
+            combo_size = int(args[3])
+            pick = int(opts['pick']) if opts.get('pick') else None
+            draws = draws_from_rows(read_table(args[2], sheet), opts.get('cols'))
+            gap = opts.get('gap')
+            cache = opts.get('cache')
+            results = search(draws, int(opts.get('pool', 39)), combo_size, int(opts.get('top', 200)),
+                             int(gap) if gap else None, opts.get('engine', 'loop'),
+                             (cache or args[2]) if cache is not None else None, opts.get('score') or 'full', pick)
+            if results is None:
+                return 1
+        elif args[1] == 'batch':
+            pick = int(opts['pick']) if opts.get('pick') else None
+            draws = draws_from_rows(read_table(args[2], sheet), opts.get('cols'))
+            configs = read_configs(args[3])
+            cache = opts.get('cache')
+            results = batch(draws, configs, int(opts.get('pool', 39)), opts.get('engine', 'loop'),
+                            (cache or args[2]) if cache is not None else None, pick)
+            if results is None:
+                return 1
+        else:
+            draws = draws_from_rows(read_table(args[2], sheet), opts.get('cols'))
+            sections = sections_from_rows(read_table(args[3], opts.get('sections-sheet') or None))
+            results = backtest(draws, sections, opts.get('engine') or 'loop')
+    if args[1] == 'batch':
+        if out is None:
+            print(json.dumps([{'config': c, 'results': r} for c, r in zip(configs, results)],
+                             ensure_ascii=False, indent=1))
+            return 0
+        os.makedirs(out, exist_ok=True)
+        ext = opts.get('format') or 'csv'
+        for c, r in zip(configs, results):
+            write_results(r, os.path.join(out, f'{config_name(c)}.{ext}'))
+        print(f'已输出 {len(configs)} 组结果到 {out}', file=sys.stderr)
+        return 0
+    write_results(results, out)
+    return 0
+
+if __name__ == '__main__':
+    freeze_support()
+    sys.exit(cli(sys.argv))
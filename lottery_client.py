@@ -0,0 +1,90 @@
+'''lottery_server 的轻量客户端：只用标准库，供 AppleScript 调用，服务未启动时自动在后台启动
+
+用法：
+    python lottery_client.py search <SheetRange> <combo_size> <excel_path> [top_n] [max_gap_limit] [--pool=39] [--pick=N] [--score=full,w50]
+    python lottery_client.py backtest <excel_path> <原始表> <範圍> <排列表>
+    python lottery_client.py status | shutdown
+共同选项：--port=8765；自动启动服务时 --server-args="--engine=numpy --cache" 原样转交。
+'''
+import os
+import sys
+import json
+import time
+import shlex
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+
+from xlsm_io import split_options
+
+port = 8765
+start_timeout = 30      # 自动启动服务后最多等待几秒
+
+def call(path, body=None, timeout=None):
+    '''GET（body 为 None）或 POST JSON，返回回应的 dict'''
+    data = None if body is None else json.dumps(body, ensure_ascii=False).encode('utf-8')
+    req = urllib.request.Request(f'http://127.0.0.1:{port}{path}', data=data,
+                                 headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read() or b'{}')
+
+def ensure_server(server_args=''):
+    '''服务未响应时在后台启动 lottery_server.py（输出写到临时目录的 lottery_server.log）并等待就绪'''
+    try:
+        return call('/status', timeout=2)
+    except OSError:
+        pass
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lottery_server.py')
+    log = open(os.path.join(tempfile.gettempdir(), 'lottery_server.log'), 'a')
+    subprocess.Popen([sys.executable, server, f'--port={port}'] + shlex.split(server_args),
+                     stdout=log, stderr=log, stdin=subprocess.DEVNULL, start_new_session=True,
+                     env=dict(os.environ, PYTHONUNBUFFERED='1'))
+    deadline = time.time() + start_timeout
+    while time.time() < deadline:
+        time.sleep(0.2)
+        try:
+            return call('/status', timeout=2)
+        except OSError:
+            continue
+    raise SystemExit(f'lottery_server 未能在 {start_timeout}s 内启动，请查看 lottery_server.log')
+
+def main(argv):
+    global port
+    args, opts = split_options(argv[1:])
+    port = int(opts.get('port') or port)
+    cmd = args[0] if args else ''
+    if cmd == 'search' and len(args) >= 4:
+        body = {'range': args[1], 'combo_size': int(args[2]), 'file': os.path.abspath(args[3]),
+                'top_n': int(args[4]) if len(args) > 4 and args[4] else None,
+                'max_gap': int(args[5]) if len(args) > 5 and args[5] else None,
+                'pool': int(opts['pool']) if opts.get('pool') else None,
+                'pick': int(opts['pick']) if opts.get('pick') else None,
+                'score': opts.get('score') or None}
+        path = '/search'
+    elif cmd == 'backtest' and len(args) == 5:
+        body = {'file': os.path.abspath(args[1]), 'draws_sheet': args[2], 'col_range': args[3],
+                'prize_sheet': args[4]}
+        path = '/backtest'
+    elif cmd == 'status':
+        print(json.dumps(call('/status', timeout=5), ensure_ascii=False))
+        return 0
+    elif cmd == 'shutdown':
+        try:
+            call('/shutdown', {}, timeout=5)
+        except OSError:
+            pass
+        return 0
+    else:
+        print(__doc__)
+        return 1
+    ensure_server(opts.get('server-args', ''))
+    res = call(path, body)
+    print(json.dumps(res, ensure_ascii=False))
+    return 0 if res.get('ok') else 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,126 @@
+'''NumPy 向量化计分核心：以打包的位元掩码一次计算一整块组合对全部期数的命中
+
+掩码统一打包为 (个数, words) 的 uint64 数组，号码池超过 64 个时每个掩码占多个字。
+'''
+import numpy as np
+
+block_size = 2048       # 每次向量化计算的组合数（受 block × 期数 的内存限制）
+
+if hasattr(np, 'bitwise_count'):
+    popcount = np.bitwise_count
+else:
+    # 旧版 NumPy 没有 bitwise_count，退回逐字节查表
+    _POP8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(arr):
+        arr = np.ascontiguousarray(arr, dtype=np.uint64)
+        return _POP8[arr.view(np.uint8)].reshape(arr.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+WORD = (1 << 64) - 1
+
+def pack_masks(masks, words=1):
+    '''Python int 掩码列表 → (len, words) 的 uint64 数组，低位字在前'''
+    out = np.empty((len(masks), words), dtype=np.uint64)
+    if words == 1:
+        out[:, 0] = masks
+    else:
+        for w in range(words):
+            out[:, w] = [(m >> (64 * w)) & WORD for m in masks]
+    return out
+
+def unpack_mask(row):
+    '''pack_masks 的一行 → Python int 掩码'''
+    m = 0
+    for w in range(len(row) - 1, -1, -1):
+        m = (m << 64) | int(row[w])
+    return m
+
+def match_counts(c_masks, d_masks):
+    '''(B, words) 组合掩码 × (T, words) 期数掩码 → (B, T) 的命中个数（逐字 AND + popcount 累加）'''
+    matches = popcount(c_masks[:, None, 0] & d_masks[None, :, 0])
+    for w in range(1, c_masks.shape[1]):
+        matches += popcount(c_masks[:, None, w] & d_masks[None, :, w])
+    return matches
+
+def _last_hit(cond):
+    '''每行最后一次为 True 的期号（从 1 起算），没有则为 -1'''
+    total = cond.shape[1]
+    pos = cond[:, ::-1].argmax(axis=1)
+    return np.where(cond.any(axis=1), total - pos, -1)
+
+def _max_gap(cond, last):
+    '''每行的最大差值（相邻命中间隔的最大值，首末两端也算），与 compute_max_gap 一致
+
+    只遍历命中位置：同一行内相邻命中的期号差取最大，再并上末期到最后一次命中的差值。
+    '''
+    rows, cols = np.nonzero(cond)
+    out = cond.shape[1] + 1 - np.maximum(last, 0)
+    if len(rows):
+        pos = cols + 1
+        gap = np.empty_like(pos)
+        gap[0] = pos[0]
+        gap[1:] = pos[1:] - pos[:-1]
+        first = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        gap[first] = pos[first]
+        hit_rows = rows[first]
+        out[hit_rows] = np.maximum(out[hit_rows], np.maximum.reduceat(gap, first))
+    return out
+
+def score_matches(matches):
+    '''由 (组合数 × 期数) 的命中个数矩阵算出 cnt2/cnt3/cnt4/cntE4/cnt5/cntE5、last2/last3/lastE4/last5/lastE5
+    以及 gap2/gap3/gapE4/gapE5
+
+    与 lottery_search.process_chunk 的逐期循环逐位一致，返回 15 个长度为组合数的 int64 数组。
+    '''
+    ge2 = matches >= 2
+    ge3 = matches >= 3
+    ge4 = matches >= 4
+    ge5 = matches >= 5
+    eq4 = matches == 4
+    eq5 = matches == 5
+    counts = [c.sum(axis=1, dtype=np.int64) for c in (ge2, ge3, ge4, eq4, ge5, eq5)]
+    lasts = [_last_hit(c) for c in (ge2, ge3, eq4, ge5, eq5)]
+    gaps = [_max_gap(c, l) for c, l in zip((ge2, ge3, eq4, eq5), (lasts[0], lasts[1], lasts[2], lasts[4]))]
+    return counts + lasts + gaps
+
+def _conditions(matches):
+    '''≥2、≥3、≥4、=4、≥5、=5 六个门槛的命中矩阵，次序同 COUNT_FIELDS'''
+    return (matches >= 2, matches >= 3, matches >= 4, matches == 4, matches >= 5, matches == 5)
+
+def score_weights(matches, weights, rows=256):
+    '''(组合数 × 期数) 命中个数矩阵按 (期数 × S) 的每期权重加权计数，返回 6 个 (组合数 × S) 的 int64 数组
+
+    权重为整数值的 float64（见 lottery_search.spec_weights），部分和都是 2**53 以内的整数，
+    矩阵乘法的累加次序不影响结果，与逐期循环逐位一致。权重全为 0 的前段期数不参与计算；
+    多个窗口／半衰期同为一次矩阵乘法的几栏，不会按个数倍增扫描期数的次数。
+    '''
+    nz = np.flatnonzero(weights.any(axis=1))
+    first = nz[0] if len(nz) else weights.shape[0]
+    weights = weights[first:]
+    out = [np.zeros((len(matches), weights.shape[1]), dtype=np.int64) for _ in range(6)]
+    for r in range(0, len(matches), rows):
+        for o, c in zip(out, _conditions(matches[r:r + rows, first:])):
+            o[r:r + rows] = c.astype(np.float64) @ weights
+    return out
+
+def draw_tables(d_masks, n):
+    '''分支限界用的逐号码表：has[b] 为各期是否含号码 b+1，below[b] 为各期小于 b+1 的号码个数'''
+    bits = np.arange(n)
+    words = d_masks[:, bits // 64].T
+    has = ((words >> (bits % 64).astype(np.uint64)[:, None]) & np.uint64(1)).astype(np.uint8)
+    below = np.zeros((n + 1, len(d_masks)), dtype=np.uint8)
+    np.cumsum(has, axis=0, dtype=np.uint8, out=below[1:])
+    return has, below
+
+def upper_bounds(pm, room, weights=None):
+    '''前缀命中数 pm、每期最多还能再命中 room 个时，各门槛计数的上界
+
+    返回 (ub2, ub3, ub4, ubE4, ubE5)：任意补全方式下对应计数都不会超过这些值。
+    给出 (期数 × S) 的每期权重时改为加权计数的上界，返回 S 个这样的元组。
+    '''
+    ub = pm + room
+    conds = (ub >= 2, ub >= 3, ub >= 4, (ub >= 4) & (pm <= 4), (ub >= 5) & (pm <= 5))
+    if weights is None:
+        return tuple(np.count_nonzero(c) for c in conds)
+    sums = [(c.astype(np.float64) @ weights).astype(np.int64).tolist() for c in conds]
+    return list(zip(*sums))
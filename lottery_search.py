@@ -0,0 +1,804 @@
+'''组合搜索核心：开奖掩码、子进程计分引擎（loop／numpy／bnb／index）与多进程 top_n 汇总
+
+不依赖 Tk、Excel 或 openpyxl；mac_app（图形界面 + 工作簿）与 lottery_api（无界面接口与命令行）
+都只是设定本模块的全局参数后调用 search_full / search_cached。
+'''
+import os
+import json
+import time
+from math import comb
+import heapq
+import queue
+from array import array
+import threading
+from multiprocessing import Pool, cpu_count
+
+import combo_rank
+
+# -------------------------------------------------
+# 全域變數
+top_n = 200             # 要保留的最佳組合数
+max_gap_limit = 1000000  # 最大相邻中奖期距阈值
+lottery_masks = []      # 子进程初始化后存放掩码（共享内存上的 memoryview，或普通列表）
+lottery_shm = None      # 子进程挂接的 SharedMemory，需保持引用
+lottery_masks_np = None # numpy 引擎下的 uint64 掩码数组
+lottery_tables = None   # bnb 引擎的逐号码表 (has, below)
+lottery_index = None    # index 引擎的逐号码期数位集（draw_index.number_bits）
+combo_size = 5          # 子进程初始化后存放组合大小
+pool_size = 39          # 号码池大小（号码为 1..pool_size），超过 64 时掩码按多个 uint64 字存放
+chunk_size_for_combos = None    # 固定的分块组合数；None 时按校准结果自适应分块（见 plan_ranges）
+calibration_combos = 500        # 自适应分块：先给每个进程一块这么多组合，以最先完成的一块测出每组合耗时
+chunk_secs = (0.05, 2.0)        # 自适应分块单块的预计耗时下限（摊薄传输开销）与上限（进度与取消的响应）
+engine = 'loop'         # 计分引擎：loop（逐期循环参考实现）、numpy、bnb（分支限界剪枝）或 index（期数位集索引）
+verify_engine = False   # 为 True 时再用 loop 引擎重算一遍并逐块比对
+crosscheck = False      # 为 True 时在主进程内以单一区块重算一遍，与并行（或缓存）结果逐行比对
+cancel_event = threading.Event()  # 置位后计算线程结束进程池，search_full 返回 None
+metrics_out = None      # 度量输出：None 不记录，'' 以 JSON lines 打印到 stdout，否则追加到该文件
+profile_dir = None      # 非 None 时子进程以 cProfile 记录计分，各写 worker-<pid>.prof 到此目录
+worker_profile = None   # 子进程中的 cProfile.Profile
+gap_filtered = 0        # 子进程当前区块因最大差值超限而未入堆的（组合, 段）次数
+selectors = None        # 同一趟计分要同时选出的 [(top_n, max_gap_limit, 评分方式)]；None 时只有全局这一组
+score_mode = 'full'     # 默认评分方式：full、w<N>（最近 N 期）或 d<H>（半衰期 H 期的指数衰减），见 parse_score
+# -------------------------------------------------
+
+def mask_words(n):
+    '''号码池大小 → 每个掩码所需的 uint64 字数（lottery_engine、combo_cache、draw_store 共用）'''
+    return (n + 63) // 64
+
+def build_masks(draws, n):
+    '''每期号码 → 位元掩码；返回 (掩码列表, 超出 1..n 而被丢弃的号码个数)'''
+    masks = []
+    dropped = 0
+    for nums in draws:
+        mm = 0
+        for v in nums:
+            if 1 <= v <= n:
+                mm |= 1 << (v - 1)
+            else:
+                dropped += 1
+        masks.append(mm)
+    return masks, dropped
+
+def pack_words(masks, words=1):
+    '''掩码 → 每期 words 个 uint64 字（低位字在前）的扁平 array('Q')'''
+    return array('Q', [(m >> (64 * w)) & 0xFFFFFFFFFFFFFFFF for m in masks for w in range(words)])
+
+def share_masks(masks, words=1):
+    '''把掩码按 words 个 uint64 字一行打包放进一块共享内存，返回 SharedMemory 对象（由调用方 close/unlink）'''
+    from multiprocessing import shared_memory
+    flat = pack_words(masks, words)
+    shm = shared_memory.SharedMemory(create=True, size=max(8, 8 * len(flat)))
+    shm.buf[:8 * len(flat)] = flat.tobytes()
+    return shm
+
+def attach_masks(shm_name, n_words):
+    '''子进程以零拷贝方式挂接共享内存中的掩码，返回 (SharedMemory, 'Q' 格式的 memoryview)
+
+    shm_name 为 draw_store 存档文件时改为唯读 mmap 该文件，返回 (mmap, memoryview)。
+    '''
+    if os.path.isfile(shm_name):
+        import draw_store
+        return draw_store.map_masks(shm_name, n_words)
+    from multiprocessing import shared_memory
+    try:
+        shm = shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:
+        # Python 3.13 之前挂接也会登记，但子进程与主进程共用同一个 resource_tracker，
+        # 重复登记无害，最终由主进程 unlink 时注销
+        shm = shared_memory.SharedMemory(name=shm_name)
+    return shm, shm.buf.cast('Q')[:n_words]
+
+def init_pool(shm_name, n_draws, l_combo_size, l_top_n=None, l_engine='loop', l_max_gap=None, l_pool_size=39,
+              l_profile_dir=None):
+    global lottery_shm, profile_dir, worker_profile
+    lottery_shm, flat = attach_masks(shm_name, n_draws * mask_words(l_pool_size))
+    init_worker(flat, n_draws, l_combo_size, l_top_n, l_engine, l_max_gap, l_pool_size)
+    profile_dir = l_profile_dir
+    if profile_dir is not None:
+        import cProfile
+        worker_profile = cProfile.Profile()
+
+def init_worker(flat, n_draws, l_combo_size, l_top_n=None, l_engine='loop', l_max_gap=None, l_pool_size=39):
+    '''按 pack_words 的布局装载掩码（共享内存上的 memoryview 或普通 array('Q')）并设定子进程参数'''
+    global lottery_masks, lottery_masks_np, lottery_tables, lottery_index, combo_size, top_n, engine, max_gap_limit
+    global pool_size
+    words = mask_words(l_pool_size)
+    lottery_masks = flat
+    combo_size = l_combo_size
+    pool_size = l_pool_size
+    if l_top_n is not None:
+        top_n = l_top_n
+    if l_max_gap is not None:
+        max_gap_limit = l_max_gap
+    engine = l_engine
+    if engine in ('numpy', 'bnb'):
+        import numpy as np
+        lottery_masks_np = np.frombuffer(flat, dtype=np.uint64, count=n_draws * words).reshape(n_draws, words)
+        if engine == 'bnb':
+            import lottery_engine
+            lottery_tables = lottery_engine.draw_tables(lottery_masks_np, pool_size)
+    if engine in ('loop', 'index') or words > 1:
+        # 逐期循环每个组合都要把整段历史重新拆箱一遍，换成 int 列表更快（只是 n_draws 个小整数）；
+        # 多字掩码时 memoryview 是逐字而非逐期的，--verify 的参考循环也需要这份列表
+        flat = lottery_masks.tolist()
+        lottery_masks = [sum(flat[i + w] << (64 * w) for w in range(words)) for i in range(0, len(flat), words)]
+    if engine == 'index':
+        import draw_index
+        lottery_index = draw_index.number_bits(lottery_masks, pool_size)
+
+def parse_score(spec):
+    '''评分方式：full（全部期数的命中数）、w<N>（最近 N 期的命中数）或 d<H>（半衰期 H 期的指数衰减命中数）'''
+    spec = (spec or 'full').strip().lower()
+    if spec == 'full':
+        return spec
+    if spec[:1] in ('w', 'd') and spec[1:].isdigit() and int(spec[1:]) > 0:
+        return f'{spec[0]}{int(spec[1:])}'
+    raise ValueError(f'无效的评分方式：{spec}（应为 full、w<期数> 或 d<半衰期期数>）')
+
+def score_label(spec):
+    '''表头后缀：full 为空，w50 为「(近50期)」，d30 为「(衰減30)」'''
+    if spec == 'full':
+        return ''
+    return f'(近{spec[1:]}期)' if spec[0] == 'w' else f'(衰減{spec[1:]})'
+
+DECAY_SCALE = 1 << 30   # 衰减权重放大成整数：最近一期为 DECAY_SCALE，各引擎的加权和因此逐位相同
+_weights = {}
+
+def spec_weights(spec, total):
+    '''评分方式 → 第 1..total 期的整数权重（下标 0 不用）：w<N> 为最近 N 期 1、其余 0；
+    d<H> 为 round(DECAY_SCALE × 0.5 ** ((total − 期号) / H))，约 31H 期以前的权重为 0'''
+    key = (spec, total)
+    if key not in _weights:
+        n = int(spec[1:])
+        if spec[0] == 'w':
+            w = [0] + [0] * max(total - n, 0) + [1] * min(n, total)
+        else:
+            w = [0] + [round(DECAY_SCALE * 0.5 ** ((total - idx) / n)) for idx in range(1, total + 1)]
+        _weights[key] = w
+    return _weights[key]
+
+def score_value(spec, v):
+    '''写出用的数值：衰减计数换回「等效命中期数」，保留 3 位小数'''
+    return round(v / DECAY_SCALE, 3) if spec[0] == 'd' else v
+
+def score_specs(sel):
+    '''sel 中用到的非 full 评分方式（去重、保持次序）；item 的第 17 个字段按此次序存放各方式的六个计数'''
+    return list(dict.fromkeys(s for _, _, s in sel if s != 'full'))
+
+def spec_slots(sel, specs):
+    '''每个选取条件的计数来源：None 为全部期数，否则为 item[16] 中的下标'''
+    return [None if s == 'full' else specs.index(s) for _, _, s in sel]
+
+def weight_matrix(specs, total):
+    '''numpy／bnb 引擎用的 (期数 × 方式数) float64 权重矩阵'''
+    import numpy as np
+    key = (tuple(specs), total, 'matrix')
+    if key not in _weights:
+        _weights[key] = np.array([spec_weights(s, total)[1:] for s in specs], dtype=np.float64).T.copy()
+    return _weights[key]
+
+def level_scores(lv):
+    '''按命中个数累加的权重 lv[j]（恰好命中 j 个）→ (≥2, ≥3, ≥4, =4, ≥5, =5)'''
+    lv = lv + [0] * (6 - len(lv))
+    return (sum(lv[2:]), sum(lv[3:]), sum(lv[4:]), lv[4], sum(lv[5:]), lv[5])
+
+def current_selectors():
+    return selectors or [(top_n, max_gap_limit, score_mode)]
+
+def new_heap_sets(sel):
+    '''每个选取条件各一组 2星／3星／4星／5星 小堆'''
+    return [([], [], [], []) for _ in sel]
+
+def push_all(heap_sets, sel, slots, item):
+    for heaps, (n, gap_limit, _), si in zip(heap_sets, sel, slots):
+        push_item(heaps, item, n, gap_limit, si)
+
+def push_item(heaps, item, top_n, max_gap_limit, si=None):
+    '''按 2星／3星／精确4星／精确5星 的排序键把 item 放入各自的 top_n 小堆
+
+    si 为 None 时排序键取全部期数的计数，否则取 item[16][si]（窗口或衰减计数）。
+    堆中的键为 (排序键, −掩码)：同分时 colex 排名小（掩码小）者优先，这是全部引擎、合并与缓存共用的全序，
+    结果因此与分块大小、进程数无关。
+    最大差值（始终按全部期数）超过 max_gap_limit 的组合不进入对应的堆，差值过滤因此作用于全部组合。
+    '''
+    global gap_filtered
+    heap2, heap3, heap4, heap5 = heaps
+    cnt2, cnt3, cnt4, cntE4, cnt5, cntE5 = item[1:7] if si is None else item[16][si]
+    gap2, gap3, gapE4, gapE5 = item[12:16]
+    tie = -item[0]
+    # 2星堆
+    if gap2 <= max_gap_limit:
+        key2 = ((cnt2, cnt3, cnt4), tie)
+        if len(heap2) < top_n: heapq.heappush(heap2, (key2, item))
+        elif key2 > heap2[0][0]: heapq.heapreplace(heap2, (key2, item))
+    else:
+        gap_filtered += 1
+    # 3星堆
+    if gap3 <= max_gap_limit:
+        key3 = ((cnt3, cnt4, cnt2), tie)
+        if len(heap3) < top_n: heapq.heappush(heap3, (key3, item))
+        elif key3 > heap3[0][0]: heapq.heapreplace(heap3, (key3, item))
+    else:
+        gap_filtered += 1
+    # 4星堆 (精确4星)
+    if gapE4 <= max_gap_limit:
+        key4 = (cntE4, tie)
+        if len(heap4) < top_n: heapq.heappush(heap4, (key4, item))
+        elif key4 > heap4[0][0]: heapq.heapreplace(heap4, (key4, item))
+    else:
+        gap_filtered += 1
+    # 5星堆 (精确5星)
+    if gapE5 <= max_gap_limit:
+        key5 = (cntE5, tie)
+        if len(heap5) < top_n: heapq.heappush(heap5, (key5, item))
+        elif key5 > heap5[0][0]: heapq.heapreplace(heap5, (key5, item))
+    else:
+        gap_filtered += 1
+
+def process_chunk(rank_range):
+    '''多进程计算：维护 2星／3星／精确4星／精确5星 的 top_n 小堆（逐期循环，作为参考实现）
+
+    rank_range 为 colex 排名区间 (start, end)，子进程在本地逐个生成组合掩码；
+    堆中 item 的第一个字段是组合掩码，由主进程再还原为号码元组。
+    最大差值（相邻命中间隔的最大值，含首末两端）在同一趟循环中一并算出。
+    窗口计数 = 全部计数 − 窗口起点之前的计数：循环按各窗口起点分段，段界记下累计计数，
+    窗口再多也只是多记几次；衰减计数在命中时按命中个数累加该期权重。
+    返回每个选取条件（current_selectors）一组小堆的列表。
+    '''
+    sel = current_selectors()
+    heap_sets = new_heap_sets(sel)
+    specs = score_specs(sel)
+    slots = spec_slots(sel, specs)
+    total = len(lottery_masks)
+    cuts = sorted({max(total - int(s[1:]), 0) for s in specs if s[0] == 'w'} - {0})
+    segments = list(zip([0] + cuts, cuts + [total]))
+    decays = [spec_weights(s, total) for s in specs if s[0] == 'd']
+    for m in combo_rank.iter_masks(*rank_range, combo_size):
+        cnt2 = cnt3 = cnt4 = cntE4 = cnt5 = cntE5 = 0
+        last2 = last3 = lastE4 = last5 = lastE5 = 0
+        gap2 = gap3 = gapE4 = gapE5 = 0
+        snaps = {0: (0, 0, 0, 0, 0, 0)}
+        levels = [[0] * (combo_size + 1) for _ in decays]
+        for a, b in segments:
+            snaps[a] = (cnt2, cnt3, cnt4, cntE4, cnt5, cntE5)
+            for idx, lm in enumerate(lottery_masks if b - a == total else lottery_masks[a:b], start=a + 1):
+                matches = (m & lm).bit_count()
+                if matches >= 2:
+                    cnt2 += 1
+                    if idx - last2 > gap2: gap2 = idx - last2
+                    last2 = idx
+                    for w, lv in zip(decays, levels):
+                        lv[matches] += w[idx]
+                    if matches >= 3:
+                        cnt3 += 1
+                        if idx - last3 > gap3: gap3 = idx - last3
+                        last3 = idx
+                        if matches >= 4:
+                            cnt4 += 1
+                            if matches == 4:
+                                cntE4 += 1
+                                if idx - lastE4 > gapE4: gapE4 = idx - lastE4
+                                lastE4 = idx
+                            else:
+                                cnt5 += 1; last5 = idx
+                                if matches == 5:
+                                    cntE5 += 1
+                                    if idx - lastE5 > gapE5: gapE5 = idx - lastE5
+                                    lastE5 = idx
+        # 未命中时 last 为 0，“未開”即为 total，与最后一次命中到末期的差值一起并入最大差值
+        gap2 = max(gap2, total + 1 - last2)
+        gap3 = max(gap3, total + 1 - last3)
+        gapE4 = max(gapE4, total + 1 - lastE4)
+        gapE5 = max(gapE5, total + 1 - lastE5)
+        counts = (cnt2, cnt3, cnt4, cntE4, cnt5, cntE5)
+        scores = []
+        dl = iter(levels)
+        for spec in specs:
+            if spec[0] == 'w':
+                base = snaps[max(total - int(spec[1:]), 0)]
+                scores.append(tuple(c - b for c, b in zip(counts, base)))
+            else:
+                scores.append(level_scores(next(dl)))
+        item = (m, cnt2, cnt3, cnt4, cntE4, cnt5, cntE5,
+                total - last2, total - last3, total - lastE4, total - last5, total - lastE5,
+                gap2, gap3, gapE4, gapE5, tuple(scores))
+        push_all(heap_sets, sel, slots, item)
+    return heap_sets
+
+def process_chunk_numpy(rank_range):
+    '''与 process_chunk 相同的输出，但按 lottery_engine.block_size 分块做向量化计数'''
+    import lottery_engine
+    sel = current_selectors()
+    heap_sets = new_heap_sets(sel)
+    specs = score_specs(sel)
+    slots = spec_slots(sel, specs)
+    total = len(lottery_masks_np)
+    wmat = weight_matrix(specs, total) if specs else None
+    bs = lottery_engine.block_size
+    start, end = rank_range
+    for b in range(start, end, bs):
+        block = list(combo_rank.iter_masks(b, min(b + bs, end), combo_size))
+        matches = lottery_engine.match_counts(lottery_engine.pack_masks(block, lottery_masks_np.shape[1]),
+                                              lottery_masks_np)
+        res = lottery_engine.score_matches(matches)
+        cnts = [a.tolist() for a in res[:6]]
+        diffs = [[total - x if x != -1 else total for x in a.tolist()] for a in res[6:11]]
+        gaps = [a.tolist() for a in res[11:]]
+        weighted = [a.tolist() for a in lottery_engine.score_weights(matches, wmat)] if specs else None
+        for i, m in enumerate(block):
+            scores = tuple(zip(*(w[i] for w in weighted))) if specs else ()
+            item = (m, cnts[0][i], cnts[1][i], cnts[2][i], cnts[3][i], cnts[4][i], cnts[5][i],
+                    diffs[0][i], diffs[1][i], diffs[2][i], diffs[3][i], diffs[4][i],
+                    gaps[0][i], gaps[1][i], gaps[2][i], gaps[3][i], scores)
+            push_all(heap_sets, sel, slots, item)
+    return heap_sets
+
+def heaps_reject(heaps, ub, top_n):
+    '''四个堆都已满且上界都不超过各自的堆顶时，整棵子树都不可能入堆
+
+    块内按排名升序访问，之后的组合掩码都比堆中的大，同分时必然排在堆顶之后，所以只需比较排序键。
+    '''
+    heap2, heap3, heap4, heap5 = heaps
+    if min(len(heap2), len(heap3), len(heap4), len(heap5)) < top_n:
+        return False
+    ub2, ub3, ub4, ubE4, ubE5 = ub
+    return ((ub2, ub3, ub4) <= heap2[0][0][0] and (ub3, ub4, ub2) <= heap3[0][0][0]
+            and ubE4 <= heap4[0][0][0] and ubE5 <= heap5[0][0][0])
+
+def walk_prefixes(rank_range, k, n, step, leaf, state):
+    '''在排名区间内按 colex 前缀深度优先枚举 k 个号码（位号 0..n-1）的组合，访问次序即排名次序
+
+    step(i, b, state) 在第 i 小的号码选定为 b（i > 1）时返回子树的状态，返回 None 则整棵子树跳过；
+    leaf(mask, lo, hi, state) 处理前缀 mask 下最小号码取 lo..hi-1 的一段组合，已按排名区间裁好。
+    '''
+    start, end = rank_range
+
+    def walk(i, hi, base, mask, st):
+        # 在 [i-1, hi) 中选第 i 小的号码（位号 b）；base 为已选更大号码贡献的排名
+        if i == 1:
+            lo, hi = max(0, start - base), min(hi, end - base)
+            if lo < hi:
+                leaf(mask, lo, hi, st)
+            return
+        for b in range(i - 1, hi):
+            r0 = base + comb(b, i)
+            if r0 >= end:
+                break
+            if r0 + comb(b, i - 1) <= start:
+                continue
+            nxt = step(i, b, st)
+            if nxt is not None:
+                walk(i - 1, b, r0, mask | 1 << b, nxt)
+
+    walk(k, n, 0, 0, state)
+
+def process_chunk_bnb(rank_range):
+    '''分支限界：与 process_chunk 结果相同，但可整棵跳过不可能入堆的子树
+
+    按 colex 前缀深度优先（先定最大的号码，再依次往小选），访问次序即排名次序。
+    对每个前缀，每期的命中数至多为“前缀命中数 + min(剩余个数, 该期小于前缀最小号码的号码数)”，
+    由此得到各门槛计数的上界（窗口／衰减计数则是这些期的加权和）；堆满且上界不超过堆顶时，
+    子树中任何组合都无法入堆。最后一层把同一前缀下的全部组合作为一块向量化计分。
+    '''
+    import numpy as np
+    import lottery_engine
+    sel = current_selectors()
+    heap_sets = new_heap_sets(sel)
+    specs = score_specs(sel)
+    slots = spec_slots(sel, specs)
+    has, below = lottery_tables
+    total = has.shape[1]
+    wmat = weight_matrix(specs, total) if specs else None
+
+    def step(i, b, pm):
+        pm2 = pm + has[b]
+        room = np.minimum(below[b], i - 1)
+        ub = lottery_engine.upper_bounds(pm2, room)
+        ubw = None      # 加权上界只在有窗口／衰减选取条件的堆已满时才计算
+        for heaps, (n, _, _), si in zip(heap_sets, sel, slots):
+            if si is not None and ubw is None and min(map(len, heaps)) >= n:
+                ubw = lottery_engine.upper_bounds(pm2, room, wmat)
+            if not heaps_reject(heaps, ub if si is None else ubw and ubw[si], n):
+                return pm2
+        return None
+
+    def leaf(mask, lo_c, hi_c, pm):
+        # 同一前缀下的全部组合作为一块向量化计分
+        matches = pm[None, :] + has[lo_c:hi_c]
+        res = lottery_engine.score_matches(matches)
+        cols = [a.tolist() for a in res]
+        weighted = [a.tolist() for a in lottery_engine.score_weights(matches, wmat)] if specs else None
+        for j, c in enumerate(range(lo_c, hi_c)):
+            last2, last3, lastE4, last5, lastE5 = (cols[x][j] for x in range(6, 11))
+            scores = tuple(zip(*(w[j] for w in weighted))) if specs else ()
+            item = (mask | 1 << c, cols[0][j], cols[1][j], cols[2][j], cols[3][j], cols[4][j], cols[5][j],
+                    total - last2 if last2 != -1 else total, total - last3 if last3 != -1 else total,
+                    total - lastE4 if lastE4 != -1 else total, total - last5 if last5 != -1 else total,
+                    total - lastE5 if lastE5 != -1 else total,
+                    cols[11][j], cols[12][j], cols[13][j], cols[14][j], scores)
+            push_all(heap_sets, sel, slots, item)
+
+    walk_prefixes(rank_range, combo_size, has.shape[0], step, leaf, np.zeros(total, dtype=np.uint8))
+    return heap_sets
+
+def process_chunk_index(rank_range):
+    '''与 process_chunk 相同的输出，但由 draw_index 的期数位集递推出各门槛的命中期
+
+    按 colex 前缀深度优先（同 process_chunk_bnb），每加入一个号码只做一次 draw_index.extend；
+    叶子的计数就是各门槛位集的 bit_count。最大差值与「未開」只在组合可能入堆时才从位集算出。
+    '''
+    import draw_index
+    sel = current_selectors()
+    heap_sets = new_heap_sets(sel)
+    specs = score_specs(sel)
+    slots = spec_slots(sel, specs)
+    bits = lottery_index
+    total = len(lottery_masks)
+    decays = {}
+    for s in specs:
+        if s[0] == 'd':
+            w = spec_weights(s, total)
+            decays[s] = (w, next((i for i, x in enumerate(w[1:]) if x), total))
+
+    def weigh(levels, spec):
+        # 各门槛位集 → 与 item[1:7] 同序的 (≥2, ≥3, ≥4, =4, ≥5, =5) 计数
+        if spec[0] == 'w':
+            c = [draw_index.window_count(x, total, int(spec[1:])) for x in levels[2:]]
+        else:
+            c = [draw_index.weighted_count(x, *decays[spec]) for x in levels[2:]]
+        return c[0], c[1], c[2], c[2] - c[3], c[3], c[3] - c[4]
+
+    def leaf(m, levels):
+        ge2, ge3, ge4, ge5, ge6 = levels[2:]
+        c2, c3, c4, c5 = ge2.bit_count(), ge3.bit_count(), ge4.bit_count(), ge5.bit_count()
+        counts = (c2, c3, c4, c4 - c5, c5, c5 - ge6.bit_count())
+        scores = tuple(weigh(levels, s) for s in specs)
+        for heaps, (n, _, _), si in zip(heap_sets, sel, slots):
+            cnt = counts if si is None else scores[si]
+            if not heaps_reject(heaps, cnt[:4] + cnt[5:], n):
+                break
+        else:
+            return
+        e4, e5 = ge4 & ~ge5, ge5 & ~ge6
+        item = (m,) + counts + (
+            total - ge2.bit_length(), total - ge3.bit_length(), total - e4.bit_length(),
+            total - ge5.bit_length(), total - e5.bit_length(),
+            draw_index.max_gap(ge2, total), draw_index.max_gap(ge3, total),
+            draw_index.max_gap(e4, total), draw_index.max_gap(e5, total), scores)
+        push_all(heap_sets, sel, slots, item)
+
+    def leaves(mask, lo, hi, levels):
+        for b in range(lo, hi):
+            leaf(mask | 1 << b, draw_index.extend(levels, bits[b]))
+
+    # 至少递推到 ≥6：精确 5 星 = ≥5 − ≥6；组合不足 6 个号码时高门槛位集恒为 0
+    walk_prefixes(rank_range, combo_size, pool_size, lambda i, b, levels: draw_index.extend(levels, bits[b]),
+                  leaves, draw_index.start_levels(total, 6))
+    return heap_sets
+
+def verify_partials(ref, got):
+    '''逐块比较参考引擎与候选引擎的小堆内容，返回不一致的块数'''
+    bad = 0
+    for a, b in zip(ref, got):
+        if tuple(a) != tuple(b):
+            bad += 1
+    return bad + abs(len(ref) - len(got))
+
+def compute_max_gap(combo, masks, threshold, exact=False):
+    '''计算所有“差值”（相邻命中间隔），并返回最大差值'''
+    m = combo_rank.combo_to_mask(combo)
+    prev = 0
+    diffs = []
+    total = len(masks)
+    for idx, lm in enumerate(masks, start=1):
+        matches = (m & lm).bit_count()
+        ok = (matches == threshold) if exact else (matches >= threshold)
+        if ok:
+            diffs.append(idx - prev)
+            prev = idx
+    diffs.append(total + 1 - prev)
+    return max(diffs) if diffs else total
+
+def search_cached(masks, combo_size, path, scores=None):
+    '''增量模式：只对缓存之后新增的期数计分，再从完整状态中选出四段结果
+
+    窗口／衰减评分只需权重非零的最近几期，选取时对全部组合现算；scores 的用法同 search_full。
+    '''
+    import combo_cache
+    if not path.endswith('.npz'):
+        path = combo_cache.default_cache_path(path, combo_size)
+    t0 = time.time()
+    state, c_masks, scored = combo_cache.sync_cache(path, combo_size, pool_size, masks)
+    secs = time.time() - t0
+    print(f'增量缓存：{path}，本次计分 {scored}/{len(masks)} 期，耗时 {secs:.2f}s')
+    emit('cache', path=path, scored=scored, draws=len(masks), combos=len(c_masks), secs=secs)
+    t0 = time.time()
+    found = [combo_cache.select(state, c_masks, len(masks), top_n, max_gap_limit, spec, masks)
+             for spec in scores or [score_mode]]
+    emit('select', secs=time.time() - t0)
+    return found if scores else found[0]
+
+def emit(event, **fields):
+    '''按 metrics_out 输出一条 JSON lines 度量记录'''
+    if metrics_out is None:
+        return
+    line = json.dumps(dict(t=round(time.time(), 3), event=event, **fields), ensure_ascii=False)
+    if metrics_out == '':
+        print(line)
+    else:
+        with open(metrics_out, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+def run_chunk(rank_range):
+    '''子进程入口：按当前引擎处理一个排名区间，连同区间与本块统计（进程号、计分秒数、差值过滤数、完成时刻）一起返回
+
+    小堆为每个选取条件一组的列表（见 current_selectors）。
+    '''
+    global gap_filtered
+    worker = {'numpy': process_chunk_numpy, 'bnb': process_chunk_bnb,
+              'index': process_chunk_index}.get(engine, process_chunk)
+    gap_filtered = 0
+    t0 = time.perf_counter()
+    if worker_profile is not None:
+        worker_profile.enable()
+        try:
+            heap_sets = worker(rank_range)
+        finally:
+            worker_profile.disable()
+            # 子进程由进程池结束，无法在退出时写出，只能每块覆盖写一次累计结果
+            worker_profile.dump_stats(os.path.join(profile_dir, f'worker-{os.getpid()}.prof'))
+    else:
+        heap_sets = worker(rank_range)
+    secs = time.perf_counter() - t0
+    return rank_range, heap_sets, {'pid': os.getpid(), 'secs': secs, 'gap_filtered': gap_filtered,
+                                   'end': time.time()}
+
+def push_bounded(heap, key, row, top_n):
+    '''全局 top_n 小堆：放得进才返回 True（key 含 −掩码，彼此不等，不会比较到 row）'''
+    if len(heap) < top_n:
+        heapq.heappush(heap, (key, row))
+    elif key > heap[0][0]:
+        heapq.heapreplace(heap, (key, row))
+    else:
+        return False
+    return True
+
+def merge_partial(merged, partial, n=None, spec='full', si=None):
+    '''把一个块的四个小堆并入全局小堆；子进程已按最大差值过滤，这里只做 n（默认 top_n）截断
+
+    spec 不是 full 时计数栏取 item[16][si] 中该评分方式的计数（衰减计数按 score_value 换算后写出）。
+    '''
+    n = n or top_n
+    m2, m3, m4, m5 = merged
+    heap2, heap3, heap4, heap5 = partial
+    v = (lambda x: x) if spec == 'full' else (lambda x: score_value(spec, x))
+
+    def fields(item):
+        m, cnt2, cnt3, cnt4, cntE4, cnt5, cntE5, diff2, diff3, diffE4, diff5, diffE5, gap2, gap3, gapE4, gapE5 = item[:16]
+        if si is not None:
+            cnt2, cnt3, cnt4, cntE4, cnt5, cntE5 = item[16][si]
+        return (combo_rank.mask_to_combo(m), cnt2, cnt3, cnt4, cntE4, cnt5, cntE5, diff2, diff3, diffE4, diffE5,
+                gap2, gap3, gapE4, gapE5)
+    # 合并沿用子进程的全序键 (排序键, −掩码)，3星的排序键同样含 2星 计数
+    # 2星
+    for _, item in heap2:
+        combo, cnt2, cnt3, cnt4, cntE4, cnt5, cntE5, diff2, diff3, diffE4, diffE5, gap2, gap3, gapE4, gapE5 = fields(item)
+        push_bounded(m2, ((cnt2, cnt3, cnt4), -item[0]), (combo, v(cnt2), v(cnt3), v(cnt4), v(cnt5), diff2, gap2), n)
+    # 3星
+    for _, item in heap3:
+        combo, cnt2, cnt3, cnt4, cntE4, cnt5, cntE5, diff2, diff3, diffE4, diffE5, gap2, gap3, gapE4, gapE5 = fields(item)
+        push_bounded(m3, ((cnt3, cnt4, cnt2), -item[0]), (combo, v(cnt3), v(cnt4), v(cnt5), diff3, gap3), n)
+    # 4星（精确4星）
+    for _, item in heap4:
+        combo, cnt2, cnt3, cnt4, cntE4, cnt5, cntE5, diff2, diff3, diffE4, diffE5, gap2, gap3, gapE4, gapE5 = fields(item)
+        push_bounded(m4, (cntE4, -item[0]), (combo, v(cntE4), v(cnt5), diffE4, gapE4), n)
+    # 5星（精确5星）
+    for _, item in heap5:
+        combo, cnt2, cnt3, cnt4, cntE4, cnt5, cntE5, diff2, diff3, diffE4, diffE5, gap2, gap3, gapE4, gapE5 = fields(item)
+        push_bounded(m5, (cntE5, -item[0]), (combo, v(cntE5), diffE5, gapE5), n)
+
+def report_progress(done, total, t0):
+    elapsed = max(time.time() - t0, 1e-9)
+    rate = done / elapsed
+    eta = (total - done) / rate if rate else 0
+    print(f'进度：{done}/{total}（{done*100/total:.1f}%），{rate:,.0f} 组合/秒，预计剩余 {eta:.1f}s')
+
+def run_task(task):
+    '''进程池任务：(排名区间, 组合大小, 选取条件, 是否用 loop 参考实现)；同一个进程池可服务不同组合大小'''
+    global combo_size, selectors
+    rank_range, combo_size, selectors, reference = task
+    if reference:
+        return process_chunk(rank_range)
+    return run_chunk(rank_range)
+
+def start_pool(masks, store=None):
+    '''建立共享掩码与常驻进程池，返回 (Pool, SharedMemory)，用完交给 stop_pool
+
+    store 为 draw_store 存档路径（其前 len(masks) 期即 masks）时子进程直接映射该文件，不建共享内存，
+    SharedMemory 为 None。
+    '''
+    if store:
+        name, shm = store, None
+    else:
+        shm = share_masks(masks, mask_words(pool_size))
+        name = shm.name
+    try:
+        pool = Pool(cpu_count(), initializer=init_pool,
+                    initargs=(name, len(masks), combo_size, top_n, engine, max_gap_limit, pool_size,
+                              profile_dir))
+    except BaseException:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        raise
+    return pool, shm
+
+def stop_pool(pool, shm):
+    pool.terminate()
+    pool.join()
+    if shm is not None:
+        shm.close()
+        shm.unlink()
+
+def search_full(masks, combo_size, scores=None, store=None):
+    '''全量模式：多进程对全部组合计分（同一趟算出最大差值并过滤），各块结果到达即并入全局 top_n
+
+    scores 为评分方式列表时同一趟计分为每种方式各选出一份，返回与之对应的列表；省略时按 score_mode。
+    store 见 start_pool。
+    '''
+    pool, shm = start_pool(masks, store)
+    try:
+        found = search_multi(pool, combo_size, [(top_n, max_gap_limit, s) for s in scores or [score_mode]])
+    finally:
+        stop_pool(pool, shm)
+    if found is None or scores:
+        return found
+    return found[0]
+
+def plan_ranges(start, total, n_proc, per_combo):
+    '''自适应分块：[start, total) 按「剩余组合 / (2 × 进程数)」递减切块（guided 调度），
+
+    每块预计耗时夹在 chunk_secs 之间；前面的大块摊薄传输开销，越往后块越小，最后各进程几乎同时收工。
+    per_combo 为校准得到的每组合计分秒数。
+    '''
+    lo = max(1, int(chunk_secs[0] / max(per_combo, 1e-9)))
+    hi = max(lo, int(chunk_secs[1] / max(per_combo, 1e-9)))
+    ranges = []
+    s = start
+    while s < total:
+        size = min(hi, max(lo, (total - s) // (2 * n_proc)))
+        ranges.append((s, min(s + size, total)))
+        s += size
+    return ranges
+
+def search_multi(pool, combo_size, sel):
+    '''在已启动的进程池上对全部组合计分一次，同时为 sel 中每个 (top_n, max_gap_limit, 评分方式) 选出四段结果
+
+    未固定 chunk_size_for_combos 时先发出每进程一块的校准块，第一块完成就按其每组合耗时规划其余区间
+    （plan_ranges），校准块本身照常并入结果。返回与 sel 对应的结果列表；被取消时返回 None。
+    '''
+    total = comb(pool_size, combo_size)
+    print(f'总组合数：{total}')
+    n_proc = cpu_count()
+    results = queue.Queue()
+
+    def submit(rs):
+        for r in rs:
+            pool.apply_async(run_task, ((r, combo_size, sel, False),),
+                             callback=results.put, error_callback=results.put)
+
+    if chunk_size_for_combos:
+        ranges = combo_rank.rank_ranges(total, chunk_size_for_combos)
+        planned = True
+    else:
+        ranges = combo_rank.rank_ranges(min(total, n_proc * calibration_combos), calibration_combos)
+        planned = False
+    submit(ranges)
+
+    merged = [([], [], [], []) for _ in sel]
+    slots = spec_slots(sel, score_specs(sel))
+    got = {}
+    done = 0
+    workers = {}            # 进程号 → [区块数, 组合数, 计分秒数, 最后一块完成时刻]
+    merge_secs = wait_secs = 0.0
+    filtered = 0
+    t0 = last_report = time.time()
+    while done < total:
+        # 每轮都先查取消：结果源源不断时也要及时停下
+        if cancel_event.is_set():
+            print('已取消，正在结束子进程…')
+            return None
+        t1 = time.perf_counter()
+        try:
+            res = results.get(timeout=0.2)
+        except queue.Empty:
+            wait_secs += time.perf_counter() - t1
+            continue
+        wait_secs += time.perf_counter() - t1
+        if isinstance(res, BaseException):
+            raise res
+        rank_range, partial, stats = res
+        n = rank_range[1] - rank_range[0]
+        if not planned:
+            per_combo = stats['secs'] / n
+            rest = plan_ranges(ranges[-1][1], total, n_proc, per_combo)
+            submit(rest)
+            ranges += rest
+            planned = True
+            print(f'校准：每组合 {per_combo * 1e6:.1f}µs，其余 {total - rest[0][0] if rest else 0} 个组合分成 {len(rest)} 块')
+            emit('plan', per_combo=per_combo, chunks=len(ranges), first=rest[0][1] - rest[0][0] if rest else 0,
+                 last=rest[-1][1] - rest[-1][0] if rest else 0)
+        if verify_engine:
+            got[rank_range] = partial
+        t1 = time.perf_counter()
+        for m, heaps, (k, _, spec), si in zip(merged, partial, sel, slots):
+            merge_partial(m, heaps, k, spec, si)
+        merge_secs += time.perf_counter() - t1
+        done += n
+        w = workers.setdefault(stats['pid'], [0, 0, 0.0, 0.0])
+        w[0] += 1; w[1] += n; w[2] += stats['secs']; w[3] = max(w[3], stats['end'])
+        filtered += stats['gap_filtered']
+        emit('chunk', start=rank_range[0], end=rank_range[1], pid=stats['pid'], secs=stats['secs'],
+             rate=n / max(stats['secs'], 1e-9), gap_filtered=stats['gap_filtered'],
+             kept=sum(len(h) for heaps in partial for h in heaps))
+        if time.time() - last_report >= 1 or done == total:
+            report_progress(done, total, t0)
+            last_report = time.time()
+    wall = time.time() - t0
+    print(f'分布式计算耗时（{engine}）：{wall:.2f}s，{len(ranges)} 块')
+    busy = sum(w[2] for w in workers.values())
+    report_workers(workers, t0, wall)
+    # busy / (wall × 进程数) 低说明时间花在启动、传输或等待主进程合并，而非计分
+    emit('search', engine=engine, combos=total, chunks=len(ranges), processes=n_proc, wall=wall,
+         scoring=busy, utilization=busy / max(wall * n_proc, 1e-9), merge=merge_secs, wait=wait_secs,
+         gap_filtered=filtered, selectors=len(sel))
+    if verify_engine and engine != 'loop':
+        t1 = time.time()
+        ref = pool.map(run_task, [(r, combo_size, sel, True) for r in ranges])
+        bad = verify_partials(ref, [got[r] for r in ranges])
+        print(f'参考引擎校验耗时：{time.time()-t1:.2f}s，' + ('结果逐位一致' if bad == 0 else f'{bad} 个区块不一致'))
+
+    return final_rows(merged)
+
+def report_workers(workers, t0, wall):
+    '''各子进程的利用率（计分秒数 / 总耗时）与收工时刻；收工早于整体结束说明尾段负载不均'''
+    utils = []
+    for pid, (chunks, combos, secs, end) in sorted(workers.items()):
+        util = secs / max(wall, 1e-9)
+        idle = max(0.0, wall - (end - t0))
+        utils.append((util, pid, idle))
+        print(f'  进程 {pid}：{chunks} 块，{combos} 组合，计分 {secs:.2f}s（{util:.0%}），收工比结束早 {idle:.2f}s')
+        emit('worker', pid=pid, chunks=chunks, combos=combos, secs=secs, rate=combos / max(secs, 1e-9),
+             utilization=util, idle_tail=idle)
+    if utils:
+        low = min(utils)
+        print(f'子进程利用率：平均 {sum(u for u, _, _ in utils) / len(utils):.0%}，最低 {low[0]:.0%}（进程 {low[1]}），'
+              f'最早收工比结束早 {max(i for _, _, i in utils):.2f}s')
+
+def final_rows(merged):
+    '''全局小堆 → 按全序（排序键降序、同分排名升序）排好的四段结果，每个选取条件一份'''
+    return [tuple([row for _, row in sorted(h, key=lambda e: e[0], reverse=True)] for h in m) for m in merged]
+
+def check_single(masks, k, found, scores=None):
+    '''不分块、不经进程池，在本进程内用当前引擎把全部组合作为一块重算，与 found 逐行比较，返回不一致的段数
+
+    found 与 scores 的形状同 search_full 的参数与返回值。结果若与分块方式或进程数有关，这里就会不一致。
+    '''
+    global selectors
+    sel = [(top_n, max_gap_limit, s) for s in scores or [score_mode]]
+    t0 = time.time()
+    init_worker(pack_words(masks, mask_words(pool_size)), len(masks), k, top_n, engine, max_gap_limit, pool_size)
+    selectors = sel
+    try:
+        _, partial, _ = run_chunk((0, comb(pool_size, k)))
+    finally:
+        selectors = None
+    merged = [([], [], [], []) for _ in sel]
+    for m, heaps, (n, _, spec), si in zip(merged, partial, sel, spec_slots(sel, score_specs(sel))):
+        merge_partial(m, heaps, n, spec, si)
+    single = final_rows(merged)
+    got = found if scores else [found]
+    bad = sum(a != b for r, g in zip(single, got) for a, b in zip(r, g))
+    print(f'单进程交叉核对耗时：{time.time()-t0:.2f}s，' + ('结果逐行一致' if bad == 0 else f'{bad} 段不一致'))
+    emit('crosscheck', engine=engine, secs=time.time() - t0, mismatched=bad)
+    return bad
@@ -0,0 +1,210 @@
+'''常驻计算服务：进程池、开奖掩码与增量缓存常驻内存，供 Excel 经 AppleScript 触发的计算重复使用
+
+启动：python lottery_server.py [--port=8765] [--engine=loop|numpy|bnb|index] [--cache] [--store] [--memo] [--no-excel]
+只监听 127.0.0.1，请求与回应都是 JSON；POST 须带 Content-Type: application/json 且不带 Origin（挡掉浏览器跨站请求）：
+    POST /search    {"file": 工作簿, "range": "Sheet1!B:F", "combo_size": 5, "top_n": 200,
+                     "max_gap": null, "pool": 39, "pick": null, "score": "full,w50,d30"}
+    POST /backtest  {"file": 工作簿, "draws_sheet": "球號", "col_range": "B:F", "prize_sheet": "獲獎排列"}
+    GET  /status
+    POST /shutdown
+pick 为每期读取的号码个数，null 时为组合大小（与 lottery_api 的 search／batch 相同）。
+工作簿未变动时沿用已解析的掩码；历史与参数都相同的重复查询直接取用内存中的结果，只做写回。
+历史变动（例如新增一期）时重建共享掩码与进程池；--cache 模式下增量缓存在内存中就地追加新期数。
+客户端见 lottery_client.py。
+'''
+import os
+import sys
+import json
+import time
+import threading
+from collections import OrderedDict
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from multiprocessing import freeze_support
+
+import lottery_search as ls
+import xlsm_io
+from xlsm_io import split_options
+
+# -------------------------------------------------
+# 全域變數
+port = 8765
+use_cache = False       # --cache：以常驻内存的增量缓存代替全量计分
+excel_automation = True # --no-excel：不关闭／重开 Excel 中的工作簿
+memo_size = 32          # 保留最近多少组查询结果
+memo = OrderedDict()    # (历史哈希, 号码池, 组合大小, top_n, max_gap, 评分方式, 引擎, 缓存) → 四段结果
+histories = {}          # (工作簿, 范围, 每期个数, 号码池) → (文件状态, 掩码, 历史哈希, 存档路径或 None)
+warm_pool = None        # (历史哈希, 号码池, 引擎, 存档路径, Pool, SharedMemory)
+warm_cache = {}         # (缓存路径, 组合大小, 号码池) → (state, c_masks, 已计入期数, 历史哈希)
+# -------------------------------------------------
+
+def file_stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def load_masks(path, sheet_range, combo_size, pick, pool):
+    '''工作簿自上次读取后未变动时直接沿用掩码，返回 (掩码, 历史哈希, 存档路径或 None, 是否沿用)'''
+    import mac_app
+    import combo_cache
+    key = (path, sheet_range, pick or combo_size, pool)
+    hit = histories.get(key)
+    if hit and hit[0] == file_stamp(path):
+        return hit[1], hit[2], hit[3], True
+    mac_app.pick_size = pick
+    masks, dropped, store = mac_app.load_masks(path, sheet_range, combo_size, xlsm_io.Timer())
+    if dropped:
+        print(f'警告：有 {dropped} 个号码不在 1..{pool} 内，已忽略')
+    h = combo_cache.history_hash(masks)
+    histories[key] = (file_stamp(path), masks, h, store)
+    return masks, h, store, False
+
+def get_pool(masks, h, store=None):
+    '''历史、号码池、引擎或存档文件变了才重建共享掩码与进程池；store 为该历史自己的存档路径'''
+    global warm_pool
+    if warm_pool is not None and warm_pool[:4] == (h, ls.pool_size, ls.engine, store):
+        return warm_pool[4]
+    if warm_pool is not None:
+        ls.stop_pool(*warm_pool[4:])
+    pool, shm = ls.start_pool(masks, store)
+    warm_pool = (h, ls.pool_size, ls.engine, store, pool, shm)
+    return pool
+
+def cached_select(path, masks, h, combo_size, top_n, max_gap, score):
+    import combo_cache
+    cpath = combo_cache.default_cache_path(path, combo_size)
+    key = (cpath, combo_size, ls.pool_size)
+    state, c_masks, scored = combo_cache.sync_cache(cpath, combo_size, ls.pool_size, masks, warm_cache.get(key))
+    warm_cache[key] = (state, c_masks, len(masks), h)
+    print(f'增量缓存：{cpath}，本次计分 {scored}/{len(masks)} 期')
+    return combo_cache.select(state, c_masks, len(masks), top_n, max_gap, score, masks)
+
+def handle_search(req):
+    import mac_app
+    path = os.path.abspath(req['file'])
+    combo_size = int(req['combo_size'])
+    top_n = int(req.get('top_n') or 200)
+    max_gap = 1000000 if req.get('max_gap') in (None, '') else int(req['max_gap'])
+    pick = int(req['pick']) if req.get('pick') else None
+    ls.pool_size = int(req.get('pool') or 39)
+    scores = list(dict.fromkeys(ls.parse_score(s) for s in (req.get('score') or 'full').split(',')))
+    if not 1 <= combo_size <= ls.pool_size:
+        raise ValueError(f'组合大小必须在 1..{ls.pool_size} 之间')
+
+    if excel_automation:
+        mac_app.close_excel_workbook(path)
+    timer = xlsm_io.Timer()
+    with timer('读取'):
+        masks, h, store, reused = load_masks(path, req['range'], combo_size, pick, ls.pool_size)
+    keys = [(h, ls.pool_size, combo_size, top_n, max_gap, s, ls.engine, use_cache) for s in scores]
+    missing = [s for s, key in zip(scores, keys) if key not in memo]
+    hit = not missing
+    if missing:
+        # 未命中的评分方式共用同一趟计分
+        with timer('计算'):
+            if use_cache:
+                res = [cached_select(path, masks, h, combo_size, top_n, max_gap, s) for s in missing]
+            else:
+                res = ls.search_multi(get_pool(masks, h, store), combo_size, [(top_n, max_gap, s) for s in missing])
+        for s, found in zip(missing, res):
+            memo[(h, ls.pool_size, combo_size, top_n, max_gap, s, ls.engine, use_cache)] = found
+    for key in keys:
+        memo.move_to_end(key)
+    found = [memo[key] for key in keys]
+    while len(memo) > memo_size:
+        memo.popitem(last=False)
+    with timer('写回'):
+        for i, (s, res) in enumerate(zip(scores, found)):
+            mac_app.write_output(path, res, combo_size, top_n, s, mac_app.output_sheet(s, i == 0), 1 if i == 0 else None)
+    # 写回只替换输出表，开奖历史未变，记下新的文件状态以便下次沿用掩码
+    for hk, (stamp, m, hh, st) in list(histories.items()):
+        if hk[0] == path and hh == h:
+            histories[hk] = (file_stamp(path), m, hh, st)
+    timer.report()
+    if excel_automation:
+        mac_app.reopen_excel_workbook(path)
+    return {'memo': hit, 'history_reused': reused, 'draws': len(masks), 'stages': dict(timer.stages)}
+
+def handle_backtest(req):
+    import find_test
+    import mac_app
+    path = os.path.abspath(req['file'])
+    if excel_automation:
+        mac_app.close_excel_workbook(path)
+    # 对话框与 Excel 开关由服务端处理，回测本身以 headless 方式执行
+    find_test.headless = True
+    error = find_test.main(path, req['draws_sheet'], req['col_range'], req['prize_sheet'])
+    if excel_automation:
+        mac_app.reopen_excel_workbook(path)
+    if error:
+        raise RuntimeError(error)
+    return {}
+
+class Handler(BaseHTTPRequestHandler):
+    # 单线程 HTTPServer：请求依序处理，同一时间只有一个计算占用进程池
+    def reply(self, code, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/status':
+            return self.reply(404, {'ok': False, 'error': '未知路径'})
+        self.reply(200, {'ok': True, 'pid': os.getpid(), 'engine': ls.engine, 'cache': use_cache,
+                         'memo': len(memo), 'histories': len(histories), 'pool_warm': warm_pool is not None})
+
+    def do_POST(self):
+        # 浏览器的跨站表单／fetch 可以不经预检送出 text/plain，也一定带 Origin；本机客户端两者都不会
+        if self.headers.get_content_type() != 'application/json' or 'Origin' in self.headers:
+            return self.reply(403, {'ok': False, 'error': '只接受本机客户端的 application/json 请求'})
+        if self.path == '/shutdown':
+            self.reply(200, {'ok': True})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return
+        handler = {'/search': handle_search, '/backtest': handle_backtest}.get(self.path)
+        if handler is None:
+            return self.reply(404, {'ok': False, 'error': '未知路径'})
+        t0 = time.perf_counter()
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            body = handler(req)
+        except Exception as e:
+            print(f'{self.path} 失败：{e!r}')
+            return self.reply(500, {'ok': False, 'error': str(e)})
+        body.update(ok=True, secs=round(time.perf_counter() - t0, 3))
+        self.reply(200, body)
+
+    def log_message(self, fmt, *args):
+        print(f'{self.address_string()} {fmt % args}')
+
+def serve():
+    server = HTTPServer(('127.0.0.1', port), Handler)
+    print(f'lottery_server 已启动：http://127.0.0.1:{port}（引擎 {ls.engine}，缓存 {"开" if use_cache else "关"}）')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if warm_pool is not None:
+            ls.stop_pool(*warm_pool[4:])
+        print('lottery_server 已停止')
+
+if __name__ == '__main__':
+    freeze_support()
+    argv, opts = split_options(sys.argv)
+    port = int(opts.get('port') or port)
+    ls.engine = opts.get('engine') or 'numpy'
+    if ls.engine not in ('loop', 'numpy', 'bnb', 'index'):
+        print('--engine 只能是 loop、numpy、bnb 或 index'); sys.exit(1)
+    use_cache = 'cache' in opts
+    if 'store' in opts:
+        # 冷启动或历史变动时经由开奖存档读取，进程池也改为映射存档文件
+        import mac_app
+        mac_app.store_path = opts['store']
+    excel_automation = 'no-excel' not in opts
+    if 'memo' in opts:
+        # 回测的命中分布快取到工作簿旁（或指定路径），同一排列表换范围回测时沿用
+        import find_test
+        find_test.memo_path = opts['memo']
+    ls.metrics_out = opts.get('metrics')
+    serve()
@@ -2,22 +2,20 @@ import sys
 import os
 import time
 import re
-import math
-import heapq
-import itertools
 import threading
-from multiprocessing import Pool, cpu_count, freeze_support
+from multiprocessing import freeze_support
 
-import openpyxl
-from openpyxl.utils import column_index_from_string
-from openpyxl.styles import Alignment
+import lottery_search as ls
+import xlsm_io
+from xlsm_io import split_options
 
 # -------------------------------------------------
-# 全域變數
-top_n = 200             # 要保留的最佳組合数
-max_gap_limit = 1000000  # 最大相邻中奖期距阈值
-lottery_masks = []      # 子进程初始化后存放掩码列表
-chunk_size_for_combos = 100000
+# 全域變數（计分相关参数 top_n、max_gap_limit、pool_size、engine 等在 lottery_search 中）
+pick_size = None        # 每期读取的号码个数；None 时沿用组合大小（旧行为）
+cache_path = None       # 增量缓存文件；'' 表示放在工作簿旁（<工作簿>.c<组合大小>.npz）
+store_path = None       # 开奖存档（draw_store）；'' 表示放在工作簿旁（<工作簿>.<规则哈希>.draws）
+scores = ['full']       # --score：评分方式列表，第一种写入「獲獎排列」，其余各写一张「獲獎排列(近N期)」等表
+excel_automation = True # 为 False（--headless）时不关闭／重开 Excel，也不弹出 Tk 窗口
 # -------------------------------------------------
 
 def close_excel_workbook(file_path):
@@ -71,178 +69,89 @@ def pad_data(data, total_rows, num_columns):
         data.append([''] * num_columns)
     return data
 
-def init_pool(l_masks):
-    global lottery_masks
-    lottery_masks = l_masks
-
-def process_chunk(chunk_of_combos):
-    '''多进程计算：维护 2星／3星／精确4星／精确5星 的 top_n 小堆'''
-    heap2 = []; heap3 = []; heap4 = []; heap5 = []
-    total = len(lottery_masks)
-    for combo in chunk_of_combos:
-        m = 0
-        for n in combo:
-            m |= 1 << (n - 1)
-        cnt2 = cnt3 = cnt4 = cntE4 = cnt5 = cntE5 = 0
-        last2 = last3 = lastE4 = last5 = lastE5 = -1
-        for idx, lm in enumerate(lottery_masks, start=1):
-            matches = (m & lm).bit_count()
-            if matches >= 2:
-                cnt2 += 1; last2 = idx
-            if matches >= 3:
-                cnt3 += 1; last3 = idx
-            if matches >= 4:
-                cnt4 += 1
-                if matches == 4:
-                    cntE4 += 1; lastE4 = idx
-            if matches >= 5:
-                cnt5 += 1; last5 = idx
-                if matches == 5:
-                    cntE5 += 1; lastE5 = idx
-        diff2 = total - last2 if last2 != -1 else total
-        diff3 = total - last3 if last3 != -1 else total
-        diffE4 = total - lastE4 if lastE4 != -1 else total
-        diff5 = total - last5 if last5 != -1 else total
-        diffE5 = total - lastE5 if lastE5 != -1 else total
-        item = (tuple(combo), cnt2, cnt3, cnt4, cntE4, cnt5, cntE5, diff2, diff3, diffE4, diff5, diffE5)
-        # 2星堆
-        key2 = (cnt2, cnt3, cnt4)
-        if len(heap2) < top_n: heapq.heappush(heap2, (key2, item))
-        elif key2 > heap2[0][0]: heapq.heapreplace(heap2, (key2, item))
-        # 3星堆
-        key3 = (cnt3, cnt4, cnt2)
-        if len(heap3) < top_n: heapq.heappush(heap3, (key3, item))
-        elif key3 > heap3[0][0]: heapq.heapreplace(heap3, (key3, item))
-        # 4星堆 (精确4星)
-        key4 = cntE4
-        if len(heap4) < top_n: heapq.heappush(heap4, (key4, item))
-        elif key4 > heap4[0][0]: heapq.heapreplace(heap4, (key4, item))
-        # 5星堆 (精确5星)
-        key5 = cntE5
-        if len(heap5) < top_n: heapq.heappush(heap5, (key5, item))
-        elif key5 > heap5[0][0]: heapq.heapreplace(heap5, (key5, item))
-    return heap2, heap3, heap4, heap5
-
-def compute_max_gap(combo, masks, threshold, exact=False):
-    '''计算所有“差值”（相邻命中间隔），并返回最大差值'''
-    m = 0
-    for n in combo:
-        m |= 1 << (n - 1)
-    prev = 0
-    diffs = []
-    total = len(masks)
-    for idx, lm in enumerate(masks, start=1):
-        matches = (m & lm).bit_count()
-        ok = (matches == threshold) if exact else (matches >= threshold)
-        if ok:
-            diffs.append(idx - prev)
-            prev = idx
-    diffs.append(total + 1 - prev)
-    return max(diffs) if diffs else total
-
-def main(sheet_range, combo_size, file_path):
-    freeze_support()
-    print(f'文件：{file_path}，范围：{sheet_range}，组合大小：{combo_size}')
-    print(f'top_n={top_n}，max_gap_limit={max_gap_limit}')
-
-    close_excel_workbook(file_path)
-    time.sleep(0.2)
-
-    wb = openpyxl.load_workbook(file_path, data_only=True, keep_vba=True)
-    ws = wb[wb.sheetnames[0]]
+def parse_range(sheet_range):
+    '''Sheet!B2:F100 形式的范围 → (首行, 末行或 None, 首栏, 末栏)；首行默认为 1'''
     rng = sheet_range.split('!',1)[-1].replace('$','')
     try:
         sc, ec = rng.split(':')
-    except:
-        print('范围格式错误'); sys.exit(1)
+    except ValueError:
+        raise ValueError('范围格式错误')
     sm = re.match(r'([A-Za-z]+)(\d+)?', sc)
     em = re.match(r'([A-Za-z]+)(\d+)?', ec)
     if not sm or not em:
-        print('解析范围失败'); sys.exit(1)
+        raise ValueError('解析范围失败')
     sr = int(sm.group(2) or 1)
-    er = int(em.group(2) or ws.max_row)
-    c1 = column_index_from_string(sm.group(1))
-    c2 = column_index_from_string(em.group(1))
-    it = ws.iter_rows(min_row=sr, max_row=er, min_col=c1, max_col=c2, values_only=True)
-    try:
-        headers = next(it)
-    except StopIteration:
-        print('无数据'); sys.exit(1)
-    rows = list(it)
-    wb.close()
-
-    import pandas as pd
-    df = pd.DataFrame(rows, columns=headers).dropna()
-    draws = df.iloc[:, :combo_size].astype(int).values.tolist()
-
-    masks = []
-    for nums in draws:
-        mm = 0
-        for v in nums:
-            if 1 <= v <= 39:
-                mm |= 1 << (v - 1)
-        masks.append(mm)
-
-    from math import comb
-    total = comb(39, combo_size)
-    print(f'总组合数：{total}')
-    all_combos = itertools.combinations(range(1,40), combo_size)
-
-    def chunker(it, size):
-        buf = []
-        for x in it:
-            buf.append(x)
-            if len(buf) == size:
-                yield buf
-                buf = []
-        if buf:
-            yield buf
-
-    t0 = time.time()
-    with Pool(cpu_count(), initializer=init_pool, initargs=(masks,)) as pool:
-        partials = pool.map(process_chunk, chunker(all_combos, chunk_size_for_combos))
-    print(f'分布式计算耗时：{time.time()-t0:.2f}s')
-
-    # ===== 先根据最大差值过滤，再取 top_n =====
-    # 2星
-    all2 = {}
-    for heap2, _, _, _ in partials:
-        for _, item in heap2:
-            combo, cnt2, cnt3, cnt4, cntE4, cnt5, cntE5, diff2, diff3, diffE4, diff5, diffE5 = item
-            gap2 = compute_max_gap(combo, masks, threshold=2)
-            if gap2 <= max_gap_limit:
-                all2[tuple(combo)] = (combo, cnt2, cnt3, cnt4, cnt5, diff2, gap2)
-    sorted2 = sorted(all2.values(), key=lambda x: (x[1], x[2], x[3]), reverse=True)[:top_n]
-
-    # 3星
-    all3 = {}
-    for _, heap3, _, _ in partials:
-        for _, item in heap3:
-            combo, cnt2, cnt3, cnt4, cntE4, cnt5, cntE5, diff2, diff3, diffE4, diff5, diffE5 = item
-            gap3 = compute_max_gap(combo, masks, threshold=3)
-            if gap3 <= max_gap_limit:
-                all3[tuple(combo)] = (combo, cnt3, cnt4, cnt5, diff3, gap3)
-    sorted3 = sorted(all3.values(), key=lambda x: (x[1], x[2]), reverse=True)[:top_n]
-
-    # 4星（精确4星）
-    all4 = {}
-    for _, _, heap4, _ in partials:
-        for _, item in heap4:
-            combo, cnt2, cnt3, cnt4, cntE4, cnt5, cntE5, diff2, diff3, diffE4, diff5, diffE5 = item
-            gap4 = compute_max_gap(combo, masks, threshold=4, exact=True)
-            if gap4 <= max_gap_limit:
-                all4[tuple(combo)] = (combo, cntE4, cnt5, diffE4, gap4)
-    sorted4 = sorted(all4.values(), key=lambda x: x[1], reverse=True)[:top_n]
-
-    # 5星（精确5星）
-    all5 = {}
-    for _, _, _, heap5 in partials:
-        for _, item in heap5:
-            combo, cnt2, cnt3, cnt4, cntE4, cnt5, cntE5, diff2, diff3, diffE4, diff5, diffE5 = item
-            gap5 = compute_max_gap(combo, masks, threshold=5, exact=True)
-            if gap5 <= max_gap_limit:
-                all5[tuple(combo)] = (combo, cntE5, diffE5, gap5)
-    sorted5 = sorted(all5.values(), key=lambda x: x[1], reverse=True)[:top_n]
+    er = int(em.group(2)) if em.group(2) else None
+    return sr, er, xlsm_io.col_index(sm.group(1)), xlsm_io.col_index(em.group(1))
+
+def draw_row(row, n):
+    '''一行 → 前 n 个号码；与原先 DataFrame.dropna() 相同，范围内任一格为空的行返回 None'''
+    if all(v is not None and v == v for v in row):
+        return [int(v) for v in row[:n]]
+    return None
+
+def read_history(file_path, sheet_range, combo_size, timer):
+    '''按 Sheet!B:F 形式的范围读取第一张表的开奖号码（首行为表头），每期取前 pick_size（默认组合大小）个'''
+    with timer('载入'):
+        wb = xlsm_io.open_readonly(file_path)
+    ws = wb[wb.sheetnames[0]]
+    sr, er, c1, c2 = parse_range(sheet_range)
+    with timer('读取'):
+        it = ws.iter_rows(min_row=sr, max_row=er, min_col=c1, max_col=c2, values_only=True)
+        try:
+            next(it)
+        except StopIteration:
+            raise ValueError('无数据')
+        rows = list(it)
+        wb.close()
+
+    with timer('转换'):
+        n = pick_size or combo_size
+        return [d for d in (draw_row(row, n) for row in rows) if d is not None]
+
+def load_masks(file_path, sheet_range, combo_size, timer):
+    '''返回 (开奖掩码, 超出号码池而被丢弃的号码个数, 存档路径或 None)
+
+    设定了 store_path 时经由 draw_store 存档：第一张表未变动就直接映射存档，不解析工作簿；
+    把返回的存档路径交给 lottery_search.start_pool，计算子进程也改为映射同一个存档文件。
+    '''
+    if store_path is None:
+        draws = read_history(file_path, sheet_range, combo_size, timer)
+        with timer('掩码'):
+            masks, dropped = ls.build_masks(draws, ls.pool_size)
+        return masks, dropped, None
+    import draw_store
+    n = pick_size or combo_size
+    sr, er, c1, c2 = parse_range(sheet_range)
+    rule = f'mac_app|{sheet_range}|{n}|{ls.pool_size}'
+    path = store_path or draw_store.default_store_path(file_path, rule)
+
+    def read_rows():
+        # 范围首行是表头，数据从下一列开始
+        start = sr + 1
+        wb = xlsm_io.open_readonly(file_path)
+        try:
+            ws = wb[wb.sheetnames[0]]
+            for r, row in enumerate(ws.iter_rows(min_row=start, max_row=er, min_col=c1, max_col=c2,
+                                                 values_only=True), start):
+                d = draw_row(row, n)
+                if d is not None:
+                    yield r, d
+        finally:
+            wb.close()
+
+    with timer('存档'):
+        masks, scanned, dropped = draw_store.sync_store(path, file_path, None, rule, ls.pool_size, n, read_rows)
+    print(f'开奖存档：{path}，本次写入 {scanned}/{len(masks)} 期')
+    return masks, dropped, path
+
+def output_sheet(spec, first=True):
+    '''评分方式对应的输出表名：第一种为「獲獎排列」，其余加上 score_label 后缀'''
+    return '獲獎排列' if first else '獲獎排列' + ls.score_label(spec)
+
+def write_output(file_path, found, combo_size, top_n, score='full', sheet='獲獎排列', index=1):
+    '''把四段结果写成 sheet 表（默认「獲獎排列」，第 2 张），不足 top_n 行的段补空格；计数栏表头带评分方式后缀'''
+    sorted2, sorted3, sorted4, sorted5 = found
 
     # 构造写入数据，同时保留“未开”（diff）和新增“最大差值”（gap）
     data2 = [ list(combo) + [cnt2, cnt3, cnt4, cnt5, diff2, gap2] for combo, cnt2, cnt3, cnt4, cnt5, diff2, gap2 in sorted2 ]
@@ -256,64 +165,136 @@ def main(sheet_range, combo_size, file_path):
     data4 = pad_data(data4, top_n, combo_size + 4)
     data5 = pad_data(data5, top_n, combo_size + 3)
 
+    # 四段表头，段与段之间空一栏
+    nums = [f'號碼{i}' for i in range(1, combo_size+1)]
+    s = ls.score_label(score)
+    hdr2 = nums + ['2星'+s,'3星'+s,'4星'+s,'5星'+s,'未開','最大差值']
+    hdr3 = nums + ['3星'+s,'4星'+s,'5星'+s,'未開','最大差值']
+    hdr4 = nums + ['4星'+s,'5星'+s,'未開','最大差值']
+    hdr5 = nums + ['5星'+s,'未開','最大差值']
+    sections = []
+    col = 1
+    for hdr in (hdr2, hdr3, hdr4, hdr5):
+        sections.append((col, len(hdr)))
+        col += len(hdr) + 1
+
+    def out_rows():
+        yield hdr2 + [None] + hdr3 + [None] + hdr4 + [None] + hdr5
+        for r2, r3, r4, r5 in zip(data2, data3, data4, data5):
+            yield r2 + [None] + r3 + [None] + r4 + [None] + r5
+
+    # 只替换这一张表的部件，逐行串流写出，号码栏与统计栏各共用一个具名样式
+    xlsm_io.replace_sheet(file_path, sheet, out_rows(), index=index,
+                          blocks=xlsm_io.section_blocks(sections, combo_size))
+
+def main(sheet_range, combo_size, file_path):
+    freeze_support()
+    print(f'文件：{file_path}，范围：{sheet_range}，组合大小：{combo_size}')
+    print(f'top_n={ls.top_n}，max_gap_limit={ls.max_gap_limit}，号码池：1..{ls.pool_size}，评分：{",".join(scores)}')
+
+    if excel_automation:
+        close_excel_workbook(file_path)
+        time.sleep(0.2)
+
+    ls.emit('run', file=file_path, combo_size=combo_size, pool=ls.pool_size, top_n=ls.top_n,
+            max_gap=ls.max_gap_limit, engine=ls.engine, cache=cache_path, scores=scores)
+    timer = xlsm_io.Timer(hook=lambda label, secs: ls.emit('stage', stage=label, secs=secs))
+    try:
+        masks, dropped, store = load_masks(file_path, sheet_range, combo_size, timer)
+    except ValueError as e:
+        print(e); sys.exit(1)
+    ls.emit('draws', draws=len(masks), dropped=dropped)
+    if dropped:
+        print(f'警告：有 {dropped} 个号码不在 1..{ls.pool_size} 内，已忽略')
+
+    with timer('计算'):
+        if cache_path is not None:
+            found = ls.search_cached(masks, combo_size, cache_path or file_path, scores)
+        else:
+            found = ls.search_full(masks, combo_size, scores, store)
+    if found is None:
+        return
+    if ls.cancel_event.is_set():
+        print('已取消，未写回 Excel。'); return
+    if ls.crosscheck:
+        with timer('核对'):
+            ls.check_single(masks, combo_size, found, scores)
+
     # 写回 Excel
-    wb2 = openpyxl.load_workbook(file_path, keep_vba=True)
-    if '獲獎排列' in wb2.sheetnames:
-        del wb2['獲獎排列']
-    ws_out = wb2.create_sheet('獲獎排列', index=1)
+    with timer('写回'):
+        for i, (spec, res) in enumerate(zip(scores, found)):
+            write_output(file_path, res, combo_size, ls.top_n, spec, output_sheet(spec, i == 0), 1 if i == 0 else None)
+    print(f'已寫入「{"」「".join(output_sheet(s, i == 0) for i, s in enumerate(scores))}」並保存完成。')
+    timer.report()
+    if excel_automation:
+        reopen_excel_workbook(file_path)
 
-    col = 1
-    # 2星表头
-    hdr2 = [f'號碼{i}' for i in range(1, combo_size+1)] + ['2星','3星','4星','5星','未開','最大差值']
-    for j, h in enumerate(hdr2, start=col): ws_out.cell(1, j, h).alignment = Alignment('center','center')
-    for i, row in enumerate(data2, start=2):
-        for j, v in enumerate(row, start=col): ws_out.cell(i, j, v).alignment = Alignment('center','center')
-    
-    # 3星表头
-    col += len(hdr2) + 1
-    hdr3 = [f'號碼{i}' for i in range(1, combo_size+1)] + ['3星','4星','5星','未開','最大差值']
-    for j, h in enumerate(hdr3, start=col): ws_out.cell(1, j, h).alignment = Alignment('center','center')
-    for i, row in enumerate(data3, start=2):
-        for j, v in enumerate(row, start=col): ws_out.cell(i, j, v).alignment = Alignment('center','center')
-
-    # 4星表头
-    col += len(hdr3) + 1
-    hdr4 = [f'號碼{i}' for i in range(1, combo_size+1)] + ['4星','5星','未開','最大差值']
-    for j, h in enumerate(hdr4, start=col): ws_out.cell(1, j, h).alignment = Alignment('center','center')
-    for i, row in enumerate(data4, start=2):
-        for j, v in enumerate(row, start=col): ws_out.cell(i, j, v).alignment = Alignment('center','center')
-
-    # 5星表头
-    col += len(hdr4) + 1
-    hdr5 = [f'號碼{i}' for i in range(1, combo_size+1)] + ['5星','未開','最大差值']
-    for j, h in enumerate(hdr5, start=col): ws_out.cell(1, j, h).alignment = Alignment('center','center')
-    for i, row in enumerate(data5, start=2):
-        for j, v in enumerate(row, start=col): ws_out.cell(i, j, v).alignment = Alignment('center','center')
-
-    wb2.save(file_path)
-    print('已寫入「獲獎排列」並保存完成。')
-    reopen_excel_workbook(file_path)
+def run(sheet_range, combo_size, file_path):
+    '''main 的入口包装：给出 --profile 时以 cProfile 记录主进程，写出 <目录>/main.prof'''
+    if ls.profile_dir is None:
+        return main(sheet_range, combo_size, file_path)
+    import cProfile
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        return main(sheet_range, combo_size, file_path)
+    finally:
+        prof.disable()
+        prof.dump_stats(os.path.join(ls.profile_dir, 'main.prof'))
+        print(f'性能剖析已写入 {ls.profile_dir}（main.prof 与各子进程 worker-<pid>.prof）')
 
 if __name__ == '__main__':
     freeze_support()
-    if len(sys.argv) < 4:
-        print('用法：<SheetRange> <combo_size> <excel_path> [top_n] [max_gap_limit]')
+    argv, opts = split_options(sys.argv)
+    if len(argv) < 4:
+        print('用法：<SheetRange> <combo_size> <excel_path> [top_n] [max_gap_limit] [--engine=loop|numpy|bnb|index] [--verify] [--crosscheck] [--cache[=path]] [--store[=path]] [--score=full,w50,d30] [--pool=39] [--pick=N] [--chunk=N] [--headless] [--metrics[=file.jsonl]] [--profile[=dir]]')
         sys.exit(1)
 
-    sheet_range = sys.argv[1]
-    combo_size = int(sys.argv[2])
-    excel_path = sys.argv[3]
+    sheet_range = argv[1]
+    combo_size = int(argv[2])
+    excel_path = argv[3]
 
-    if len(sys.argv) >= 5:
+    if len(argv) >= 5:
         try:
-            top_n = int(sys.argv[4])
+            ls.top_n = int(argv[4])
         except ValueError:
             print('第4个参数 top_n 必须是整数'); sys.exit(1)
-    if len(sys.argv) >= 6:
+    if len(argv) >= 6:
         try:
-            max_gap_limit = int(sys.argv[5])
+            ls.max_gap_limit = int(argv[5])
         except ValueError:
             print('第5个参数 max_gap_limit 必须是整数'); sys.exit(1)
+    ls.engine = opts.get('engine', ls.engine)
+    if ls.engine not in ('loop', 'numpy', 'bnb', 'index'):
+        print('--engine 只能是 loop、numpy、bnb 或 index'); sys.exit(1)
+    ls.verify_engine = 'verify' in opts
+    ls.crosscheck = 'crosscheck' in opts
+    cache_path = opts.get('cache')
+    store_path = opts.get('store')
+    try:
+        ls.pool_size = int(opts.get('pool', ls.pool_size))
+        pick_size = int(opts['pick']) if opts.get('pick') else None
+        # 省略时按校准结果自适应分块
+        ls.chunk_size_for_combos = int(opts['chunk']) if opts.get('chunk') else None
+    except ValueError:
+        print('--pool / --pick / --chunk 必须是整数'); sys.exit(1)
+    try:
+        scores = list(dict.fromkeys(ls.parse_score(s) for s in (opts.get('score') or 'full').split(',')))
+    except ValueError as e:
+        print(e); sys.exit(1)
+    if not 1 <= combo_size <= ls.pool_size:
+        print(f'组合大小必须在 1..{ls.pool_size} 之间'); sys.exit(1)
+
+    ls.metrics_out = opts.get('metrics')
+    if 'profile' in opts:
+        ls.profile_dir = os.path.abspath(opts['profile'] or 'profile')
+        os.makedirs(ls.profile_dir, exist_ok=True)
+
+    if 'headless' in opts:
+        # 无显示器／无 Excel 的机器：直接在前台计算并写回，输出留在终端
+        excel_automation = False
+        run(sheet_range, combo_size, excel_path)
+        sys.exit(0)
 
     import tkinter as tk
     from tkinter.scrolledtext import ScrolledText
@@ -324,6 +305,16 @@ if __name__ == '__main__':
         def write(self, s): self.w.after(0, self.w.insert, tk.END, s); self.w.after(0, self.w.see, tk.END)
         def flush(self): pass
     sys.stdout = R(ta); sys.stderr = R(ta)
-    threading.Thread(target=lambda: main(sheet_range, combo_size, excel_path), daemon=True).start()
-    tk.Button(root, text='退出', command=root.destroy).pack(pady=5)
+    th = threading.Thread(target=lambda: run(sheet_range, combo_size, excel_path), daemon=True)
+    th.start()
+
+    def on_exit():
+        # 先让计算线程退出 with Pool 块（会 terminate 子进程），再关闭窗口
+        ls.cancel_event.set()
+        def wait():
+            if th.is_alive(): root.after(100, wait)
+            else: root.destroy()
+        wait()
+    tk.Button(root, text='退出', command=on_exit).pack(pady=5)
+    root.protocol('WM_DELETE_WINDOW', on_exit)
     root.mainloop()
@@ -23,6 +23,14 @@ on RunAppTask(theParams)
               quoted form of drawsSheet & " " & ¬
               quoted form of colRange & " " & ¬
               quoted form of prizeSheet
+    -- 第 5 个参数是 lottery_client.py 时交给常驻服务计算（服务未启动会自动启动）
+    if appPath ends with ".py" then
+        set cmd to "/usr/bin/env python3 " & quoted form of appPath & " backtest " & ¬
+                  quoted form of wbPath & " " & ¬
+                  quoted form of drawsSheet & " " & ¬
+                  quoted form of colRange & " " & ¬
+                  quoted form of prizeSheet & " > /dev/null 2>&1 &"
+    end if
     try
         do shell script cmd
         return "OK"
@@ -53,6 +61,15 @@ on RunAppTask(theParams)
               quoted form of wbPath      & " " & ¬
               quoted form of topN       & " " & ¬
               quoted form of maxGap
+    -- 第 4 个参数是 lottery_client.py 时交给常驻服务计算（服务未启动会自动启动）
+    if appBundle ends with ".py" then
+        set cmd to "/usr/bin/env python3 " & quoted form of appBundle & " search " & ¬
+                  quoted form of sheetRange & " " & ¬
+                  quoted form of comboSize  & " " & ¬
+                  quoted form of wbPath      & " " & ¬
+                  quoted form of topN       & " " & ¬
+                  quoted form of maxGap & " > /dev/null 2>&1 &"
+    end if
     try
         do shell script cmd
     on error errMsg
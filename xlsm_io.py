@@ -0,0 +1,336 @@
+'''工作簿讀寫：唯讀串流讀取資料範圍，寫回時只替換輸出工作表的 XML 部件
+
+寫回不經過 openpyxl 的完整載入／儲存：原始表、VBA 與其他部件原樣複製到新的 zip，
+只有輸出表本身、workbook.xml 與其關聯、[Content_Types].xml、styles.xml（必要時補上具名樣式）會被改寫。
+輸出表整列串流寫出，每個欄區塊共用一個具名樣式。遇到無法辨識的結構時退回 openpyxl 的完整載入寫法。
+'''
+import os
+import re
+import time
+import posixpath
+
+WS_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet'
+WS_CONTENT = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+SHEET_HEAD = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+              '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+              'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">')
+
+def open_readonly(path):
+    '''以唯讀串流模式開啟（只讀值、不載入 VBA），用完須 close()'''
+    import openpyxl
+    return openpyxl.load_workbook(path, read_only=True, data_only=True, keep_links=False)
+
+def escape(s, entities=None):
+    '''XML 文字轉義（同 xml.sax.saxutils.escape；後者會連帶匯入 urllib，啟動時多花數十毫秒）'''
+    s = s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    for k, v in (entities or {}).items():
+        s = s.replace(k, v)
+    return s
+
+def col_index(letters):
+    '''欄字母轉為 1 起算的欄號（同 openpyxl.utils.column_index_from_string，免載入 openpyxl）'''
+    i = 0
+    for ch in letters.upper():
+        if not 'A' <= ch <= 'Z':
+            raise ValueError(f'無效的欄名：{letters}')
+        i = i * 26 + ord(ch) - 64
+    return i
+
+def col_letter(i):
+    s = ''
+    while i:
+        i, r = divmod(i - 1, 26)
+        s = chr(65 + r) + s
+    return s
+
+def _attrs(s):
+    return dict(re.findall(r'([\w:]+)="([^"]*)"', s))
+
+# 輸出表共用的具名樣式（cellStyles）：號碼欄與統計欄各一個，整欄區塊共用同一個格式索引
+STYLES = {
+    '號碼': {'horizontal': 'center', 'vertical': 'center'},
+    '統計': {'horizontal': 'center', 'vertical': 'center'},
+}
+flush_rows = 1000       # 串流寫出時每累積多少列寫入一次 zip
+
+def section_blocks(sections, key_cols, key_style='號碼', value_style='統計'):
+    """sections 為 [(起始欄, 欄數)]（欄號從 1 起算）；每段前 key_cols 欄用 key_style，其餘用 value_style"""
+    blocks = []
+    for start, width in sections:
+        blocks.append((start, start + key_cols - 1, key_style))
+        if width > key_cols:
+            blocks.append((start + key_cols, start + width - 1, value_style))
+    return blocks
+
+def _sheet_chunks(rows, col_style):
+    """rows 由第 1 列第 A 欄起排列，可為串列或逐列產生的 iterable；None 為空白格，'' 為只帶格式的空格
+
+    col_style[c] 為第 c 欄（從 0 起算）的 ' s="n"' 屬性字串；逐批產生 UTF-8 位元組，不在記憶體中組出整張表。
+    """
+    head = SHEET_HEAD
+    if isinstance(rows, list) and rows:
+        width = max(len(row) for row in rows)
+        head += f'<dimension ref="A1:{col_letter(max(width, 1))}{len(rows)}"/>'
+    yield (head + '<sheetData>').encode('utf-8')
+    letters = []
+    body = []
+    for r, row in enumerate(rows, start=1):
+        if len(row) > len(letters):
+            letters.extend(col_letter(c) for c in range(len(letters) + 1, len(row) + 1))
+        cells = []
+        for c, v in enumerate(row):
+            if v is None:
+                continue
+            s = col_style[c] if c < len(col_style) else ''
+            if v == '':
+                cells.append(f'<c r="{letters[c]}{r}"{s}/>')
+            elif isinstance(v, bool):
+                cells.append(f'<c r="{letters[c]}{r}"{s} t="b"><v>{int(v)}</v></c>')
+            elif isinstance(v, (int, float)):
+                cells.append(f'<c r="{letters[c]}{r}"{s}><v>{v}</v></c>')
+            else:
+                cells.append(f'<c r="{letters[c]}{r}"{s} t="inlineStr"><is><t>{escape(str(v))}</t></is></c>')
+        if cells:
+            body.append(f'<row r="{r}">{"".join(cells)}</row>')
+        if len(body) >= flush_rows:
+            yield ''.join(body).encode('utf-8')
+            body = []
+    body.append('</sheetData></worksheet>')
+    yield ''.join(body).encode('utf-8')
+
+def _align_xml(align):
+    return '<alignment ' + ' '.join(f'{k}="{v}"' for k, v in align.items()) + '/>'
+
+def _append_xf(styles, tag, xf):
+    """在 <tag> 清單末端加上一個 xf，回傳 (styles.xml, 新 xf 的索引)；清單不存在時拋出 ValueError"""
+    m = re.search(rf'<{tag}\b([^>]*?)(?:/>|>(.*?)</{tag}>)', styles, re.S)
+    if not m:
+        raise ValueError(f'styles.xml 缺少 {tag}')
+    n = len(re.findall(r'<xf\b', m.group(2) or ''))
+    head = re.sub(r'\s*count="\d+"', '', m.group(1))
+    part = f'<{tag} count="{n + 1}"{head}>{m.group(2) or ""}{xf}</{tag}>'
+    return styles[:m.start()] + part + styles[m.end():], n
+
+def _ensure_named_style(styles, name, align):
+    """確保 styles.xml 有名為 name 的具名樣式（cellStyleXfs + cellStyles），並在 cellXfs 中找（或補上）
+    套用它的格式；回傳 (styles.xml, cellXfs 索引)。重複寫回時沿用既有項目，不會越寫越多。
+    """
+    want = {k: v for k, v in align.items() if v}
+    xml_name = escape(name, {'"': '&quot;'})
+    style_id = None
+    for a in map(_attrs, re.findall(r'<cellStyle\b([^>]*?)/?>', styles)):
+        if a.get('name') == xml_name:
+            style_id = int(a['xfId'])
+            break
+    if style_id is None:
+        xf = f'<xf numFmtId="0" fontId="0" fillId="0" borderId="0" applyAlignment="1">{_align_xml(want)}</xf>'
+        styles, style_id = _append_xf(styles, 'cellStyleXfs', xf)
+        entry = f'<cellStyle name="{xml_name}" xfId="{style_id}"/>'
+        m = re.search(r'<cellStyles\b([^>]*?)(?:/>|>(.*?)</cellStyles>)', styles, re.S)
+        if m:
+            n = len(re.findall(r'<cellStyle\b', m.group(2) or ''))
+            head = re.sub(r'\s*count="\d+"', '', m.group(1))
+            part = f'<cellStyles count="{n + 1}"{head}>{m.group(2) or ""}{entry}</cellStyles>'
+            styles = styles[:m.start()] + part + styles[m.end():]
+        else:
+            # cellStyles 依規範緊接在 cellXfs 之後
+            end = styles.index('</cellXfs>') + len('</cellXfs>')
+            styles = styles[:end] + f'<cellStyles count="1">{entry}</cellStyles>' + styles[end:]
+
+    m = re.search(r'<cellXfs\b([^>]*)>(.*?)</cellXfs>', styles, re.S)
+    if not m:
+        raise ValueError('styles.xml 缺少 cellXfs')
+    for i, (attrs, inner) in enumerate(re.findall(r'<xf\b([^>]*?)(?:/>|>(.*?)</xf>)', m.group(2), re.S)):
+        a = _attrs(attrs)
+        al = re.search(r'<alignment\b([^>]*?)/?>', inner or '')
+        if (a.get('xfId') == str(style_id)
+                and all(a.get(k, '0') == '0' for k in ('numFmtId', 'fontId', 'fillId', 'borderId'))
+                and al and _attrs(al.group(1)) == want):
+            return styles, i
+    xf = (f'<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="{style_id}" applyAlignment="1">'
+          f'{_align_xml(want)}</xf>')
+    return _append_xf(styles, 'cellXfs', xf)
+
+def _column_styles(styles, blocks, named):
+    """blocks 為 [(首欄, 末欄, 樣式名)]（欄號從 1 起算）→ (styles.xml, 每欄的 s 屬性字串串列)"""
+    xf = {}
+    col_style = []
+    for first, last, name in blocks:
+        if name not in xf:
+            styles, xf[name] = _ensure_named_style(styles, name, named[name])
+        if len(col_style) < last:
+            col_style.extend([''] * (last - len(col_style)))
+        col_style[first-1:last] = [f' s="{xf[name]}"'] * (last - first + 1)
+    return styles, col_style
+
+def _part_path(target, base='xl'):
+    if target.startswith('/'):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(base, target))
+
+def sheet_part(zin, name=None):
+    '''工作表名稱（None 為第一張）→ 其 XML 部件在 zip 中的路徑；找不到時引發 KeyError'''
+    wb_xml = zin.read('xl/workbook.xml').decode('utf-8')
+    rels = zin.read('xl/_rels/workbook.xml.rels').decode('utf-8')
+    rel_by_id = {r['Id']: r for r in (_attrs(x) for x in re.findall(r'<Relationship\b([^>]*?)/?>', rels))}
+    for m in re.finditer(r'<sheet\b([^>]*?)/>', wb_xml):
+        a = _attrs(m.group(1))
+        if name is None or a.get('name') == escape(name, {'"': '&quot;'}):
+            rid = next(v for k, v in a.items() if k.endswith(':id'))
+            return _part_path(rel_by_id[rid]['Target'])
+    raise KeyError(name)
+
+def _patch_package(zin, name, index):
+    '''改寫 workbook.xml／關聯／內容類型，回傳 (改寫後的部件 dict, 工作表部件路徑, 要移除的部件集合)'''
+    wb_xml = zin.read('xl/workbook.xml').decode('utf-8')
+    rels = zin.read('xl/_rels/workbook.xml.rels').decode('utf-8')
+    types = zin.read('[Content_Types].xml').decode('utf-8')
+    names = set(zin.namelist())
+    changed = {}
+    removed = set()
+
+    rel_list = [_attrs(r) for r in re.findall(r'<Relationship\b([^>]*?)/?>', rels)]
+    rel_by_id = {r['Id']: r for r in rel_list}
+    sheets = [(m, _attrs(m.group(1))) for m in re.finditer(r'<sheet\b([^>]*?)/>', wb_xml)]
+    target = None
+    for m, a in sheets:
+        if a.get('name') == escape(name, {'"': '&quot;'}):
+            rid = next(v for k, v in a.items() if k.endswith(':id'))
+            target = _part_path(rel_by_id[rid]['Target'])
+            break
+
+    if target is None:
+        # 新增工作表：新部件、新關聯、新 <sheet>，插入位置之後的 localSheetId／activeTab 順延
+        n = 1
+        while f'xl/worksheets/sheet{n}.xml' in names:
+            n += 1
+        target = f'xl/worksheets/sheet{n}.xml'
+        rid_n = 1
+        while f'rId{rid_n}' in rel_by_id:
+            rid_n += 1
+        rid = f'rId{rid_n}'
+        sheet_id = max([int(a.get('sheetId', 0)) for _, a in sheets] + [0]) + 1
+        prefix = re.search(r'xmlns:(\w+)="http://schemas.openxmlformats.org/officeDocument/2006/relationships"', wb_xml)
+        rp = prefix.group(1) if prefix else 'r'
+        if not prefix:
+            wb_xml = wb_xml.replace('<workbook ', '<workbook xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" ', 1)
+        new_sheet = f'<sheet name="{escape(name, {chr(34): "&quot;"})}" sheetId="{sheet_id}" {rp}:id="{rid}"/>'
+        if index is None or index >= len(sheets):
+            index = len(sheets)
+            pos = sheets[-1][0].end() if sheets else wb_xml.index('</sheets>')
+        else:
+            pos = sheets[index][0].start()
+        wb_xml = wb_xml[:pos] + new_sheet + wb_xml[pos:]
+        shift = lambda m: f'{m.group(1)}="{int(m.group(2)) + (int(m.group(2)) >= index)}"'
+        wb_xml = re.sub(r'(localSheetId|activeTab|firstSheet)="(\d+)"', shift, wb_xml)
+        rels = rels.replace('</Relationships>',
+                            f'<Relationship Id="{rid}" Type="{WS_TYPE}" Target="/{target}"/></Relationships>')
+        types = types.replace('</Types>', f'<Override PartName="/{target}" ContentType="{WS_CONTENT}"/></Types>')
+    else:
+        # 覆寫既有工作表：舊表自己的關聯（圖表、註解等）一併捨棄
+        sheet_rels = posixpath.join(posixpath.dirname(target), '_rels', posixpath.basename(target) + '.rels')
+        if sheet_rels in names:
+            removed.add(sheet_rels)
+
+    # 與 openpyxl 相同：捨棄 calcChain，由 Excel 重建
+    if 'xl/calcChain.xml' in names:
+        removed.add('xl/calcChain.xml')
+        rels = re.sub(r'<Relationship\b[^>]*?Target="[^"]*calcChain\.xml"[^>]*?/>', '', rels)
+        types = re.sub(r'<Override\b[^>]*?PartName="/xl/calcChain\.xml"[^>]*?/>', '', types)
+
+    changed['xl/workbook.xml'] = wb_xml
+    changed['xl/_rels/workbook.xml.rels'] = rels
+    changed['[Content_Types].xml'] = types
+    return changed, target, removed
+
+def replace_sheet(path, name, rows, index=None, blocks=(), styles=None):
+    """以 rows 取代（或新增於 index 位置）名為 name 的工作表，其餘部件不解析、不重新序列化
+
+    rows 可為逐列產生的 iterable，工作表 XML 邊產生邊寫入 zip；blocks 為 [(首欄, 末欄, 樣式名)]，
+    同一區塊共用 styles（預設 STYLES）中的一個具名樣式。
+    """
+    import zipfile      # 只有寫回需要；放在這裡讓運算子行程匯入本模組時不必載入
+    styles = styles or STYLES
+    tmp = path + '.tmp'
+    try:
+        zin = zipfile.ZipFile(path)
+    except zipfile.BadZipFile as e:
+        print('無法直接改寫工作表部件，改用 openpyxl 完整寫回：', e)
+        _replace_sheet_openpyxl(path, name, rows, index, blocks, styles)
+        return
+    with zin:
+        try:
+            changed, target, removed = _patch_package(zin, name, index)
+            styles_xml, col_style = _column_styles(zin.read('xl/styles.xml').decode('utf-8'), blocks, styles)
+        except (KeyError, ValueError, StopIteration) as e:
+            print('無法直接改寫工作表部件，改用 openpyxl 完整寫回：', e)
+            zin.close()
+            _replace_sheet_openpyxl(path, name, rows, index, blocks, styles)
+            return
+        changed['xl/styles.xml'] = styles_xml
+        with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as zout:
+            for info in zin.infolist():
+                if info.filename in removed or info.filename in changed or info.filename == target:
+                    continue
+                zout.writestr(info, zin.read(info.filename))
+            for part, text in changed.items():
+                zout.writestr(part, text.encode('utf-8'))
+            with zout.open(target, 'w', force_zip64=True) as fp:
+                for chunk in _sheet_chunks(rows, col_style):
+                    fp.write(chunk)
+    os.replace(tmp, path)
+
+def _replace_sheet_openpyxl(path, name, rows, index, blocks, styles):
+    import openpyxl
+    from openpyxl.styles import Alignment, NamedStyle
+    wb = openpyxl.load_workbook(path, keep_vba=True)
+    for sname in {b[2] for b in blocks}:
+        if sname not in wb.named_styles:
+            ns = NamedStyle(name=sname)
+            ns.alignment = Alignment(**styles[sname])
+            wb.add_named_style(ns)
+    if name in wb.sheetnames:
+        del wb[name]
+    ws = wb.create_sheet(name, index=len(wb.sheetnames) if index is None else index)
+    for row in rows:
+        ws.append(row)
+    for first, last, sname in blocks:
+        for col in ws.iter_cols(min_col=first, max_col=last):
+            for cell in col:
+                if cell.value is not None:
+                    cell.style = sname
+    wb.save(path)
+
+class Timer:
+    '''記錄各階段耗時：with t('讀取'): ...，最後 t.report() 印出；hook(階段, 秒數) 在每個階段結束時呼叫'''
+    def __init__(self, hook=None):
+        self.stages = []
+        self.hook = hook
+
+    def __call__(self, label):
+        self._label = label
+        return self
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        secs = time.perf_counter() - self._t0
+        self.stages.append((self._label, secs))
+        if self.hook:
+            self.hook(self._label, secs)
+
+    def report(self):
+        print('，'.join(f'{label} {secs:.2f}s' for label, secs in self.stages))
+
+def split_options(argv):
+    '''拆出 --key=value / --flag 形式的選項，其餘按原順序作為位置參數（各程式入口共用，只依賴標準庫）'''
+    args, opts = [], {}
+    for a in argv:
+        if a.startswith('--'):
+            k, _, v = a[2:].partition('=')
+            opts[k] = v
+        else:
+            args.append(a)
+    return args, opts